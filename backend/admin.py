@@ -1,14 +1,14 @@
 from fastapi import Depends, HTTPException
-from backend.auth import get_current_user
+from backend.auth import get_current_principal
 from backend.db_mongo import users_collection
 
 
-async def is_admin(user: dict = Depends(get_current_user)) -> bool:
+async def is_admin(user: dict = Depends(get_current_principal)) -> bool:
     """Check if user is an admin"""
     return user.get("is_admin", False)
 
 
-async def require_admin(user: dict = Depends(get_current_user)) -> dict:
+async def require_admin(user: dict = Depends(get_current_principal)) -> dict:
     """Dependency to require admin access"""
 
     
@@ -0,0 +1,170 @@
+# admission.py
+"""
+Admission control for upstream LLM calls.
+
+At most LLM_MAX_CONCURRENCY completions run at once per worker. Requests beyond
+that wait in a bounded queue that is:
+- prioritised: assignment chats are admitted before free-form chats
+- fair: within a priority, waiting users are served round-robin, so one user
+  sending many messages cannot starve everyone else
+When the queue is full, or a request has waited LLM_QUEUE_TIMEOUT seconds, it is
+shed with 503 + Retry-After instead of piling up behind a slow upstream.
+"""
+from fastapi import HTTPException
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+import time
+from backend.config import LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT, LLM_RETRY_AFTER
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_ASSIGNMENT = 0
+PRIORITY_CHAT = 1
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float, retry_after: int = 10):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        self.in_flight = 0
+        self.queued = 0
+        # priority -> user_id -> waiting futures (user order is the round-robin order)
+        self._queues: dict[int, OrderedDict[str, deque]] = {
+            PRIORITY_ASSIGNMENT: OrderedDict(),
+            PRIORITY_CHAT: OrderedDict()
+        }
+
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_queue_depth = 0
+        self._wait_times: deque = deque(maxlen=1000)
+
+    def _shed(self, reason: str):
+        logger.warning(f"LLM admission rejected: {reason} (in_flight={self.in_flight}, queued={self.queued})")
+        raise HTTPException(
+            status_code=503,
+            detail="The tutor is very busy right now. Please try again in a few seconds.",
+            headers={"Retry-After": str(self.retry_after)}
+        )
+
+    def _admitted(self, started: float):
+        self.admitted += 1
+        self._wait_times.append(time.monotonic() - started)
+
+    def _remove_waiter(self, priority: int, user_id: str, waiter: asyncio.Future):
+        users = self._queues[priority]
+        waiters = users.get(user_id)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            self.queued -= 1
+            if not waiters:
+                del users[user_id]
+
+    def _next_waiter(self) -> asyncio.Future | None:
+        for priority in (PRIORITY_ASSIGNMENT, PRIORITY_CHAT):
+            users = self._queues[priority]
+            if not users:
+                continue
+            user_id, waiters = next(iter(users.items()))
+            waiter = waiters.popleft()
+            self.queued -= 1
+            if waiters:
+                users.move_to_end(user_id)
+            else:
+                del users[user_id]
+            return waiter
+        return None
+
+    async def acquire(self, user_id: str, priority: int = PRIORITY_CHAT):
+        """Wait for an LLM slot; raises 503 if the queue is full or the wait times out"""
+        started = time.monotonic()
+        if self.in_flight < self.max_concurrent and self.queued == 0:
+            self.in_flight += 1
+            self._admitted(started)
+            return
+
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            self._shed("queue full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(user_id, deque()).append(waiter)
+        self.queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queued)
+
+        try:
+            await asyncio.wait_for(waiter, timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed to us just as the wait timed out; pass it on
+                self.release()
+            else:
+                self._remove_waiter(priority, user_id, waiter)
+            self.timed_out += 1
+            self._shed("queue timeout")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed to us just as we were cancelled; pass it on
+                self.release()
+            else:
+                self._remove_waiter(priority, user_id, waiter)
+            raise
+
+        self._admitted(started)
+
+    def release(self):
+        """Free a slot, handing it directly to the next waiter if there is one"""
+        while True:
+            waiter = self._next_waiter()
+            if waiter is None:
+                self.in_flight -= 1
+                return
+            if not waiter.done():
+                waiter.set_result(None)  # slot transfers; in_flight is unchanged
+                return
+
+    @asynccontextmanager
+    async def slot(self, user_id: str, priority: int = PRIORITY_CHAT):
+        await self.acquire(user_id, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        waits = sorted(self._wait_times)
+        p95 = waits[int(len(waits) * 0.95) - 1] if waits else 0.0
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrent": self.max_concurrent,
+            "queue_depth": self.queued,
+            "max_queue": self.max_queue,
+            "max_queue_depth_seen": self.max_queue_depth,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected,
+            "rejected_timeout": self.timed_out,
+            "wait_seconds_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_seconds_p95": p95,
+            "wait_seconds_max": waits[-1] if waits else 0.0
+        }
+
+
+def chat_priority(conversation: dict | None) -> int:
+    """Assignment chats are admitted ahead of free-form chats"""
+    if conversation and conversation.get("is_assignment_chat"):
+        return PRIORITY_ASSIGNMENT
+    return PRIORITY_CHAT
+
+
+admission_controller = AdmissionController(
+    max_concurrent=LLM_MAX_CONCURRENCY,
+    max_queue=LLM_MAX_QUEUE,
+    queue_timeout=LLM_QUEUE_TIMEOUT,
+    retry_after=LLM_RETRY_AFTER
+)
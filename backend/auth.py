@@ -1,66 +1,99 @@
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import jwt
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 import httpx
-import requests
 from backend.db_mongo import users_collection
-from backend.config import AUTH0_DOMAIN, AUTH0_API_AUDIENCE, ALGORITHM
+from backend.config import (
+    AUTH0_DOMAIN, AUTH0_API_AUDIENCE, ALGORITHM, TOKEN_CACHE_SIZE,
+    USER_CACHE_TTL_SECONDS, LAST_LOGIN_UPDATE_MINUTES
+)
+from backend.jwks import jwks_provider
 import logging
 from typing import Optional
-from functools import lru_cache
+from collections import OrderedDict
+import hashlib
+import time
 
 logger = logging.getLogger(__name__)
 
 http_bearer = HTTPBearer()
 
-# Cache JWKS for 1 hour to reduce calls
-@lru_cache(maxsize=1)
-def get_auth0_jwks():
-    """Fetch Auth0 JWKS for token verification (cached)"""
-    jwks_url = f"https://{AUTH0_DOMAIN}/.well-known/jwks.json"
-    logger.info(f"[AUTH] Fetching JWKS from: {jwks_url}")
-    try:
-        jwks = requests.get(jwks_url, timeout=60).json()
-        logger.info(f"[AUTH] Successfully fetched JWKS with {len(jwks.get('keys', []))} keys")
-        return jwks
-    except Exception as e:
-        logger.error(f"[AUTH] Failed to fetch JWKS: {str(e)}")
-        raise
+class VerifiedTokenCache:
+    """
+    Bounded LRU cache of verified JWT payloads.
+
+    Keyed by a SHA-256 of the raw token (the token itself is never stored) and each
+    entry expires at the token's own `exp` claim.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = self.key_for(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, payload = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return payload
+
+    def put(self, token: str, payload: dict):
+        exp = payload.get("exp")
+        if not isinstance(exp, (int, float)) or self.maxsize <= 0:
+            return
+        key = self.key_for(token)
+        self._entries[key] = (float(exp), payload)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
 
-def verify_token(token: str):
-    """Verify and decode Auth0 JWT token"""
-    logger.info("[AUTH] Starting token verification")
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+verified_token_cache = VerifiedTokenCache(maxsize=TOKEN_CACHE_SIZE)
+
+async def verify_token(token: str):
+    """Verify and decode Auth0 JWT token (verified payloads are cached until exp)"""
+    cached = verified_token_cache.get(token)
+    if cached is not None:
+        logger.debug("[AUTH] Token verification served from cache")
+        return cached
+
+    logger.debug("[AUTH] Starting token verification")
     logger.debug(f"[AUTH] Token (first 20 chars): {token[:20]}...")
     
     try:
-        jwks = get_auth0_jwks()
         unverified_header = jwt.get_unverified_header(token)
-        logger.info(f"[AUTH] Unverified header kid: {unverified_header.get('kid')}")
         logger.debug(f"[AUTH] Unverified header: {unverified_header}")
         
-        rsa_key = {}
-        for key in jwks["keys"]:
-            if key["kid"] == unverified_header["kid"]:
-                rsa_key = {
-                    "kty": key["kty"],
-                    "kid": key["kid"],
-                    "use": key["use"],
-                    "n": key["n"],
-                    "e": key["e"]
-                }
-                logger.info(f"[AUTH] Found matching RSA key for kid: {key['kid']}")
-                break
+        rsa_key = await jwks_provider.get_key(unverified_header["kid"])
         
         if not rsa_key:
             logger.error(f"[AUTH] No matching key found for kid: {unverified_header.get('kid')}")
-            logger.debug(f"[AUTH] Available kids: {[k['kid'] for k in jwks['keys']]}")
+            logger.debug(f"[AUTH] Available kids: {jwks_provider.kids()}")
             raise HTTPException(status_code=401, detail="Unable to find appropriate key")
         
-        logger.info(f"[AUTH] Decoding token with audience: {AUTH0_API_AUDIENCE}")
-        logger.info(f"[AUTH] Expected issuer: https://{AUTH0_DOMAIN}/")
-        logger.info(f"[AUTH] Algorithm: {ALGORITHM}")
-        
         payload = jwt.decode(
             token,
             rsa_key,
@@ -69,13 +102,10 @@ def verify_token(token: str):
             issuer=f"https://{AUTH0_DOMAIN}/"
         )
         
-        logger.info(f"[AUTH] Token decoded successfully")
-        logger.info(f"[AUTH] Token sub: {payload.get('sub')}")
-        logger.info(f"[AUTH] Token aud: {payload.get('aud')}")
-        logger.info(f"[AUTH] Token iss: {payload.get('iss')}")
-        logger.info(f"[AUTH] Token exp: {payload.get('exp')} (now: {datetime.now(timezone.utc).timestamp()})")
-        logger.debug(f"[AUTH] Full payload: {payload}")
+        logger.debug(f"[AUTH] Token decoded successfully for sub: {payload.get('sub')}")
+        logger.debug(f"[AUTH] Token exp: {payload.get('exp')} (now: {datetime.now(timezone.utc).timestamp()})")
         
+        verified_token_cache.put(token, payload)
         return payload
         
     except jwt.ExpiredSignatureError as e:
@@ -92,7 +122,7 @@ def verify_token(token: str):
 
 async def get_userinfo_from_token(payload: dict) -> dict:
     """Extract user info directly from JWT payload (no API call needed!)"""
-    logger.info("[AUTH] Extracting user info from token payload")
+    logger.debug("[AUTH] Extracting user info from token payload")
     
     # Try different claim formats Auth0 might use
     namespace = 'https://alaaska.com/'
@@ -124,7 +154,7 @@ async def get_userinfo_from_token(payload: dict) -> dict:
         "email_verified": email_verified
     }
     
-    logger.info(f"[AUTH] Extracted user info from token: {user_info.get('email', 'NO_EMAIL')}")
+    logger.debug(f"[AUTH] Extracted user info from token: {user_info.get('email', 'NO_EMAIL')}")
     logger.debug(f"[AUTH] Full token payload keys: {list(payload.keys())}")
     logger.debug(f"[AUTH] User info from token: {user_info}")
     
@@ -162,32 +192,107 @@ async def get_userinfo_from_api(access_token: str) -> dict:
         logger.error(f"[AUTH] Error fetching user info from API: {type(e).__name__}: {str(e)}")
         raise HTTPException(status_code=401, detail="Failed to fetch user info")
 
+class UserProfileCache:
+    """
+    Short-lived cache of user documents keyed by auth0_id.
+
+    Role changes made through routes_admin call invalidate() so they apply
+    immediately on this worker; other workers pick them up within the TTL.
+    """
+
+    def __init__(self, ttl_seconds: int = 60, maxsize: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+    def get(self, auth0_id: str) -> Optional[dict]:
+        entry = self._entries.get(auth0_id)
+        if entry is None:
+            return None
+        expires_at, user_doc = entry
+        if expires_at <= time.monotonic():
+            del self._entries[auth0_id]
+            return None
+        self._entries.move_to_end(auth0_id)
+        return user_doc
+
+    def put(self, auth0_id: str, user_doc: dict):
+        if self.ttl_seconds <= 0:
+            return
+        self._entries[auth0_id] = (time.monotonic() + self.ttl_seconds, user_doc)
+        self._entries.move_to_end(auth0_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, auth0_id: str):
+        self._entries.pop(auth0_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+user_profile_cache = UserProfileCache(ttl_seconds=USER_CACHE_TTL_SECONDS)
+
+def invalidate_user_profile(auth0_id: Optional[str]):
+    """Drop a cached user profile (call after changing roles)"""
+    if auth0_id:
+        user_profile_cache.invalidate(auth0_id)
+
+def last_login_is_stale(user_doc: dict) -> bool:
+    """True if last_login is missing or older than LAST_LOGIN_UPDATE_MINUTES"""
+    last_login = user_doc.get("last_login")
+    if not isinstance(last_login, datetime):
+        return True
+    if last_login.tzinfo is None:
+        last_login = last_login.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) - last_login > timedelta(minutes=LAST_LOGIN_UPDATE_MINUTES)
+
 async def get_or_create_user(auth0_id: str, email: str, name: str) -> dict:
-    """Get user from database or create if doesn't exist (optimized with single query)"""
+    """
+    Get user from cache/database or create if doesn't exist.
+
+    Served from user_profile_cache when possible; last_login is only written when it
+    is older than LAST_LOGIN_UPDATE_MINUTES instead of on every request.
+    """
+    cached = user_profile_cache.get(auth0_id)
+    if cached is not None:
+        return cached
+
     logger.info(f"[AUTH] Getting or creating user: {email} (auth0_id: {auth0_id})")
     
-    # Try to find and update in one operation (upsert)
-    user_doc = await users_collection.find_one_and_update(
-        {"auth0_id": auth0_id},
-        {
-            "$setOnInsert": {
-                "auth0_id": auth0_id,
-                "username": name,
-                "email": email,
-                "created_at": datetime.now(timezone.utc),
-                "is_admin": False,
-                "is_grader": False
+    user_doc = await users_collection.find_one({"auth0_id": auth0_id})
+    
+    if user_doc is None:
+        # New user: insert in one operation (upsert also covers a concurrent first login)
+        user_doc = await users_collection.find_one_and_update(
+            {"auth0_id": auth0_id},
+            {
+                "$setOnInsert": {
+                    "auth0_id": auth0_id,
+                    "username": name,
+                    "email": email,
+                    "created_at": datetime.now(timezone.utc),
+                    "is_admin": False,
+                    "is_grader": False
+                },
+                "$set": {
+                    "last_login": datetime.now(timezone.utc)
+                }
             },
-            "$set": {
-                "last_login": datetime.now(timezone.utc)
-            }
-        },
-        upsert=True,
-        return_document=True  # Return the document after update
-    )
+            upsert=True,
+            return_document=True  # Return the document after update
+        )
+    elif last_login_is_stale(user_doc):
+        now = datetime.now(timezone.utc)
+        await users_collection.update_one(
+            {"auth0_id": auth0_id},
+            {"$set": {"last_login": now}}
+        )
+        user_doc["last_login"] = now
     
     if user_doc:
         logger.info(f"[AUTH] User found/created: {email}")
+        user_profile_cache.put(auth0_id, user_doc)
         return user_doc
     else:
         logger.error(f"[AUTH] Failed to get/create user: {email}")
@@ -195,14 +300,14 @@ async def get_or_create_user(auth0_id: str, email: str, name: str) -> dict:
 
 async def get_current_user(auth: HTTPAuthorizationCredentials = Depends(http_bearer)):
     """Get current authenticated user (OPTIMIZED - minimal Auth0 API calls)"""
-    logger.info("[AUTH] get_current_user called")
+    logger.debug("[AUTH] get_current_user called")
     
     token = auth.credentials
     logger.debug(f"[AUTH] Received token (first 20 chars): {token[:20]}...")
     
     try:
         # Step 1: Verify token (uses cached JWKS)
-        payload = verify_token(token)
+        payload = await verify_token(token)
         
         # Step 2: Extract user info from token payload (NO API CALL!)
         user_info = await get_userinfo_from_token(payload)
@@ -210,7 +315,12 @@ async def get_current_user(auth: HTTPAuthorizationCredentials = Depends(http_bea
         user_id = user_info["sub"]
         email = user_info.get("email", "")
         
-        # If email not in token, fall back to API call (rare case)
+        # If email not in token, reuse the cached profile before falling back to an API call
+        if not email:
+            cached_profile = user_profile_cache.get(user_id)
+            if cached_profile:
+                email = cached_profile.get("email", "")
+
         if not email:
             logger.warning("[AUTH] Email not in token payload, fetching from Auth0 API")
             api_user_info = await get_userinfo_from_api(token)
@@ -222,7 +332,7 @@ async def get_current_user(auth: HTTPAuthorizationCredentials = Depends(http_bea
     
         user_doc = await get_or_create_user(user_id, email, name)
         
-        logger.info(f"[AUTH] Returning user data for: {email}")
+        logger.debug(f"[AUTH] Returning user data for: {email}")
         
         return {
             "auth0_id": user_id,
@@ -237,4 +347,25 @@ async def get_current_user(auth: HTTPAuthorizationCredentials = Depends(http_bea
         raise
     except Exception as e:
         logger.error(f"[AUTH] Unexpected error in get_current_user: {type(e).__name__}: {str(e)}")
-        raise HTTPException(status_code=401, detail="Authentication failed")
\ No newline at end of file
+        raise HTTPException(status_code=401, detail="Authentication failed")
+
+async def get_current_principal(
+    request: Request,
+    auth: HTTPAuthorizationCredentials = Depends(http_bearer)
+) -> dict:
+    """
+    Request-scoped current user.
+
+    Resolves the user once per request (token verification + profile lookup) and stores
+    it on request.state.principal; every other dependency that needs the user reuses it.
+    request.state.auth_resolutions counts how many times resolution actually ran, so
+    tests can assert it stays at 1.
+    """
+    principal = getattr(request.state, "principal", None)
+    if principal is not None:
+        return principal
+
+    principal = await get_current_user(auth)
+    request.state.principal = principal
+    request.state.auth_resolutions = getattr(request.state, "auth_resolutions", 0) + 1
+    return principal
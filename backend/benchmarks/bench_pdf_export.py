@@ -0,0 +1,118 @@
+# bench_pdf_export.py
+"""
+Benchmark for the Gradescope PDF export.
+
+Builds synthetic classes of 100, 500 and 2000 students (a mix of plain-text,
+markdown and long answers, some unanswered questions) and reports pages per second for:
+- single-process rendering with create_gradescope_pdf
+- render_pdf_to_file: per-student fragments across the process pool, then merged,
+  with an empty and then a warm in-memory fragment cache
+
+Usage (from the repository root):
+    python -m backend.benchmarks.bench_pdf_export [--students 100 500 2000] [--questions 5] [--skip-pool]
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+
+from backend.pdf_generator import create_gradescope_pdf, render_pdf_to_file, shutdown_pdf_executor, strip_markdown
+from backend.config import PDF_RENDER_WORKERS
+
+PLAIN_ANSWER = (
+    "The algorithm visits every vertex once and every edge at most twice, so it runs in "
+    "linear time. Correctness follows from the invariant that the frontier holds exactly "
+    "the vertices at the current distance.\n\nFor the second part the same argument applies."
+)
+MARKDOWN_ANSWER = (
+    "## Approach\n\n1. Sort the input by **start time**.\n2. Sweep once, keeping the `end` "
+    "of the last interval.\n\n- Time: *O(n log n)*\n- Space: O(1) extra\n\n"
+    "```\nfor s, e in intervals:\n    ...\n```"
+)
+
+
+def make_students(count: int, questions: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    students = []
+    for i in range(count):
+        student_questions = []
+        for q in range(questions):
+            roll = rng.random()
+            if roll < 0.1:
+                solution = None
+            elif roll < 0.55:
+                solution = f"{PLAIN_ANSWER} (student {i})"
+            elif roll < 0.9:
+                solution = f"{MARKDOWN_ANSWER}\n\nStudent {i}."
+            else:
+                solution = " ".join([PLAIN_ANSWER] * 25)
+            student_questions.append({
+                "number": str(q + 1),
+                "marks": 10,
+                "student_solution": solution,
+                "chat_id": f"chat-{i}-{q}",
+                "submitted_at": "2024-01-15T10:30:00Z" if solution else None
+            })
+        students.append({"name": f"Student {i}", "email": f"student{i}@bench.local", "questions": student_questions})
+    return students
+
+
+class MemoryFragmentCache:
+    """In-process stand-in for the Mongo fragment cache"""
+
+    def __init__(self):
+        self.fragments = {}
+
+    async def iter_many(self, keys):
+        for key in keys:
+            if key in self.fragments:
+                yield key, self.fragments[key]
+
+    async def put_many(self, fragments):
+        self.fragments.update(fragments)
+
+
+async def render_pooled(students: list, cache) -> int:
+    with await render_pdf_to_file("Benchmark Assignment", students, cache=cache) as pdf_file:
+        return os.fstat(pdf_file.fileno()).st_size
+
+
+def report(label: str, pages: int, elapsed: float, size: int):
+    print(f"  {label:<28} {elapsed:8.2f} s  {pages / elapsed:8.1f} pages/s  {size / 1e6:7.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF export benchmark")
+    parser.add_argument("--students", type=int, nargs="+", default=[100, 500, 2000])
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--skip-pool", action="store_true", help="Only benchmark single-process rendering")
+    args = parser.parse_args()
+
+    print(f"{args.questions} questions per student, 2 pages per question, {PDF_RENDER_WORKERS} render workers")
+    try:
+        for count in args.students:
+            students = make_students(count, args.questions)
+            pages = count * args.questions * 2
+            print(f"\n{count} students ({pages} pages)")
+
+            strip_markdown.cache_clear()
+            start = time.perf_counter()
+            size = len(create_gradescope_pdf("Benchmark Assignment", students).getvalue())
+            report("single process", pages, time.perf_counter() - start, size)
+            info = strip_markdown.cache_info()
+            print(f"  strip_markdown cache: {info.hits} hits, {info.misses} misses")
+
+            if args.skip_pool:
+                continue
+            cache = MemoryFragmentCache()
+            for label in ("pool, cold cache", "pool, warm cache"):
+                start = time.perf_counter()
+                size = asyncio.run(render_pooled(students, cache))
+                report(label, pages, time.perf_counter() - start, size)
+    finally:
+        shutdown_pdf_executor()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# bench_rate_limiter.py
+"""
+Microbenchmark for the in-process rate limiter.
+
+Shows that per-check cost and memory stay flat as request volume grows (the old
+list-of-timestamps limiter grew linearly with requests per window).
+
+Usage (from the repository root):
+    python -m backend.benchmarks.bench_rate_limiter [--users 5000]
+"""
+import argparse
+import os
+import time
+import tracemalloc
+
+# backend.rate_limiter pulls in the app's auth/db modules; they only need these set to import
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+os.environ.setdefault("MONGODB_CLIENT", "alaaska_bench")
+os.environ.setdefault("AUTH0_DOMAIN", "bench.local")
+
+from backend.rate_limiter import SlidingWindowCounter
+
+
+def run(total_requests: int, users: int) -> tuple[float, int, int]:
+    limiter = SlidingWindowCounter()
+    keys = [f"chat:user{i}" for i in range(users)]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for i in range(total_requests):
+        key = keys[i % users]
+        if limiter.count(key, 60) < 20:
+            limiter.record(key, 60)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed / total_requests * 1e9, len(limiter), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rate limiter microbenchmark")
+    parser.add_argument("--users", type=int, default=5000)
+    args = parser.parse_args()
+
+    print(f"{'requests':>10} {'ns/check':>10} {'keys':>8} {'peak KiB':>10}")
+    for total in (10_000, 100_000, 1_000_000):
+        ns_per_check, keys, peak = run(total, args.users)
+        print(f"{total:>10} {ns_per_check:>10.0f} {keys:>8} {peak / 1024:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# bench_student_dashboard.py
+"""
+Benchmark for GET /assignments (student dashboard) against a real MongoDB.
+
+Seeds a throwaway database with one student enrolled in a growing number of
+assignments (half of them accepted) and compares the route handler with the
+previous per-assignment find_one loop. The handler's latency should stay roughly
+flat while the loop grows linearly with the number of assignments.
+
+Usage (from the repository root, with a local mongod running):
+    python -m backend.benchmarks.bench_student_dashboard [--mongodb-url mongodb://127.0.0.1:27017] [--runs 20]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+import uuid
+from datetime import datetime, timezone
+
+STUDENT = "student@bench.local"
+QUESTIONS_PER_ASSIGNMENT = 10
+
+
+def configure_environment(mongodb_url: str):
+    """Point the app's modules at a throwaway database (they read settings at import time)"""
+    os.environ["MONGODB_URL"] = mongodb_url
+    os.environ["MONGODB_CLIENT"] = f"alaaska_bench_{uuid.uuid4().hex[:8]}"
+    os.environ.setdefault("AUTH0_DOMAIN", "bench.local")
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+
+async def legacy_dashboard(user_email: str) -> list:
+    """The previous implementation: one find_one per assignment"""
+    from backend.db_assignments import assignments_collection, student_assignments_collection
+
+    result = []
+    async for assignment in assignments_collection.find({"allowed_students": user_email}, {"_id": 0}):
+        record = await student_assignments_collection.find_one({
+            "assignment_id": assignment["assignment_id"],
+            "student_email": user_email
+        })
+        answered = sum(1 for q in (record or {}).get("questions", []) if q.get("student_solution") is not None)
+        result.append((assignment["assignment_id"], answered))
+    return result
+
+
+async def seed(count: int):
+    """Grow the student's enrolment to count assignments"""
+    from backend.db_assignments import assignments_collection, student_assignments_collection
+
+    existing = await assignments_collection.count_documents({"allowed_students": STUDENT})
+    now = datetime.now(timezone.utc)
+    for n in range(existing, count):
+        assignment_id = str(uuid.uuid4())
+        questions = [
+            {"question_id": str(uuid.uuid4()), "number": str(q + 1), "prompt_md": "x" * 400, "marks": 5, "hints": []}
+            for q in range(QUESTIONS_PER_ASSIGNMENT)
+        ]
+        await assignments_collection.insert_one({
+            "assignment_id": assignment_id,
+            "title": f"Assignment {n}",
+            "description": "Benchmark assignment",
+            "questions": questions,
+            "allowed_students": [STUDENT] + [f"other{i}@bench.local" for i in range(50)],
+            "submissions_enabled": True,
+            "submission_exceptions": [],
+            "created_at": now
+        })
+        if n % 2 == 0:
+            await student_assignments_collection.insert_one({
+                "assignment_id": assignment_id,
+                "student_email": STUDENT,
+                "accepted_at": now,
+                "questions": [
+                    {**q, "chat_id": str(uuid.uuid4()), "student_solution": "answer" if i % 3 else None}
+                    for i, q in enumerate(questions)
+                ],
+                "post_quiz_completed": False
+            })
+
+
+async def timed(fn, runs: int) -> float:
+    await fn()  # warm up
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+async def run(runs: int):
+    from backend.db_mongo import mongo_client, db
+    from backend.db_assignments import create_assignment_indexes
+    from backend.routes_assignments import get_student_assignments
+
+    user = {"email": STUDENT, "auth0_id": "bench|student"}
+    await create_assignment_indexes()
+    try:
+        print(f"{'assignments':>12} {'handler ms':>11} {'N+1 loop ms':>12}")
+        for count in (5, 20, 40, 100, 200):
+            await seed(count)
+            handler_ms = await timed(lambda: get_student_assignments(user=user), runs)
+            legacy_ms = await timed(lambda: legacy_dashboard(STUDENT), runs)
+            print(f"{count:>12} {handler_ms:>11.2f} {legacy_ms:>12.2f}")
+    finally:
+        await mongo_client.drop_database(db.name)
+        mongo_client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Student dashboard benchmark")
+    parser.add_argument("--mongodb-url", default="mongodb://127.0.0.1:27017")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    configure_environment(args.mongodb_url)
+    asyncio.run(run(args.runs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+# loadgen.py
+"""
+End-to-end load test for the ALAASKA API without real tokens or Auth0.
+
+Starts three stand-ins and the app itself:
+- stub_openai.py as the OpenAI endpoint (configurable latency/streaming/errors), which
+  also serves the JWKS for locally signed tokens (local_auth.py)
+- a local mongod (--start-mongod) or an existing one (--mongodb-url); the test uses a
+  fresh database that is dropped afterwards unless --keep-db
+- backend.main:app under uvicorn, configured through environment variables only
+
+Then drives realistic scenarios with --concurrency simultaneous virtual students:
+- free-form chat: start a chat and send --turns messages (every --stream-every-th one
+  through /chat/stream)
+- assignment: accept, open each question's chat, discuss it, submit an answer
+- an admin exports the assignment PDF --exports times once students are done
+
+and reports count, errors, p50/p95/p99/max latency and throughput per route.
+
+Usage (from the repository root):
+    python -m backend.benchmarks.loadgen --users 50 --concurrency 20 --turns 50 --start-mongod
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+import httpx
+from pymongo import MongoClient
+from backend.benchmarks.local_auth import LocalIssuer
+
+ISSUER_DOMAIN = "alaaska.local"
+AUDIENCE = "https://alaaska.local/api"
+STUDENT_MESSAGES = [
+    "I'm not sure where to start with this one.",
+    "I think we need to find the derivative first?",
+    "Okay, so the slope would be 2x. What next?",
+    "Can you give me a hint about the boundary conditions?",
+    "So the answer is x = 3 because the function is increasing there.",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(ordered: list, pct: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class Recorder:
+    """Latency samples and errors per route label"""
+
+    def __init__(self):
+        self.samples: dict[str, list] = defaultdict(list)
+        self.errors: dict[str, Counter] = defaultdict(Counter)
+
+    def add(self, label: str, seconds: float, error=None):
+        self.samples[label].append(seconds)
+        if error is not None:
+            self.errors[label][str(error)] += 1
+
+    async def call(self, client: httpx.AsyncClient, label: str, method: str, url: str, token: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = await client.request(method, url, headers={"Authorization": f"Bearer {token}"}, **kwargs)
+        except httpx.HTTPError as e:
+            self.add(label, time.perf_counter() - start, type(e).__name__)
+            return None
+        self.add(label, time.perf_counter() - start, resp.status_code if resp.status_code >= 400 else None)
+        return resp if resp.status_code < 400 else None
+
+    async def stream(self, client: httpx.AsyncClient, label: str, url: str, token: str, payload: dict):
+        """POST an SSE request; records time to first token and time to the done event"""
+        start = time.perf_counter()
+        first_token = None
+        done = None
+        try:
+            async with client.stream(
+                "POST", url, json=payload, headers={"Authorization": f"Bearer {token}"}
+            ) as resp:
+                if resp.status_code >= 400:
+                    await resp.aread()
+                    self.add(label, time.perf_counter() - start, resp.status_code)
+                    return None
+                event = None
+                async for line in resp.aiter_lines():
+                    if line.startswith("event:"):
+                        event = line.split(":", 1)[1].strip()
+                    elif line.startswith("data:"):
+                        if event is None and first_token is None:
+                            first_token = time.perf_counter() - start
+                            self.add(f"{label} (first token)", first_token)
+                        elif event == "done":
+                            done = json.loads(line[5:])
+                        elif event == "error":
+                            self.add(label, time.perf_counter() - start, "stream error")
+                            return None
+                        event = None
+        except httpx.HTTPError as e:
+            self.add(label, time.perf_counter() - start, type(e).__name__)
+            return None
+        self.add(label, time.perf_counter() - start)
+        return done
+
+    def report(self, wall_seconds: float) -> list:
+        rows = []
+        for label in sorted(self.samples):
+            ordered = sorted(self.samples[label])
+            rows.append({
+                "route": label,
+                "count": len(ordered),
+                "errors": sum(self.errors[label].values()),
+                "error_breakdown": dict(self.errors[label]),
+                "p50_ms": percentile(ordered, 50) * 1000,
+                "p95_ms": percentile(ordered, 95) * 1000,
+                "p99_ms": percentile(ordered, 99) * 1000,
+                "max_ms": ordered[-1] * 1000,
+                "rps": len(ordered) / wall_seconds if wall_seconds else 0.0
+            })
+        return rows
+
+
+# ========== SCENARIOS ==========
+
+async def free_chat(client, rec: Recorder, token: str, turns: int, stream_every: int):
+    resp = await rec.call(client, "POST /chat/start", "POST", "/chat/start", token)
+    if resp is None:
+        return
+    chat_id = resp.json()["chat_id"]
+
+    for turn in range(turns):
+        message = STUDENT_MESSAGES[turn % len(STUDENT_MESSAGES)]
+        if stream_every and (turn + 1) % stream_every == 0:
+            await rec.stream(client, "POST /chat/stream", "/chat/stream", token, {"message": message, "chat_id": chat_id})
+        else:
+            await rec.call(
+                client, "POST /chat", "POST", "/chat", token,
+                json={"message": message, "chat_id": chat_id, "delta": True}
+            )
+
+    await rec.call(client, "GET /conversations", "GET", "/conversations", token)
+    await rec.call(client, "GET /conversation/{chat_id}", "GET", f"/conversation/{chat_id}", token)
+
+
+async def assignment_session(client, rec: Recorder, token: str, assignment_id: str, turns_per_question: int):
+    resp = await rec.call(
+        client, "POST /assignments/{id}/accept", "POST", f"/assignments/{assignment_id}/accept", token
+    )
+    if resp is None:
+        return
+
+    resp = await rec.call(client, "GET /assignments/{id}", "GET", f"/assignments/{assignment_id}", token)
+    await rec.call(client, "GET /assignments", "GET", "/assignments", token)
+    if resp is None:
+        return
+    questions = resp.json().get("questions", [])
+
+    for question in questions:
+        question_id = question["question_id"]
+        resp = await rec.call(
+            client, "GET /assignments/{id}/questions/{qid}/chat", "GET",
+            f"/assignments/{assignment_id}/questions/{question_id}/chat", token
+        )
+        if resp is None:
+            continue
+        chat_id = resp.json()["chat_id"]
+
+        message = None
+        for turn in range(turns_per_question):
+            message = STUDENT_MESSAGES[turn % len(STUDENT_MESSAGES)]
+            await rec.call(
+                client, "POST /chat (assignment)", "POST", "/chat", token,
+                json={"message": message, "chat_id": chat_id, "delta": True}
+            )
+
+        if message:
+            await rec.call(
+                client, "POST /assignments/{id}/questions/{qid}/submit-answer", "POST",
+                f"/assignments/{assignment_id}/questions/{question_id}/submit-answer", token,
+                json={"chat_id": chat_id, "message_index": 0, "message_content": message}
+            )
+
+
+async def setup_assignment(client, rec: Recorder, admin_token: str, student_emails: list, questions: int) -> str:
+    template = {
+        "title": "Load test assignment",
+        "description": "Generated by backend.benchmarks.loadgen",
+        "questions": [
+            {
+                "number": str(n + 1),
+                "prompt_md": f"Find the minimum of f(x) = x^2 - {2 * (n + 1)}x + 1 and justify your answer.",
+                "marks": 5,
+                "hints": ["Think about where the derivative is zero."]
+            }
+            for n in range(questions)
+        ]
+    }
+    resp = await rec.call(client, "POST /assignment-templates", "POST", "/assignment-templates", admin_token, json=template)
+    if resp is None:
+        raise RuntimeError("Could not create the assignment template (is the admin user seeded?)")
+
+    resp = await rec.call(
+        client, "POST /assignments", "POST", "/assignments", admin_token,
+        json={"template_id": resp.json()["template_id"], "allowed_students": student_emails}
+    )
+    if resp is None:
+        raise RuntimeError("Could not create the assignment")
+    return resp.json()["assignment_id"]
+
+
+async def export_pdf(client, rec: Recorder, admin_token: str, assignment_id: str):
+    await rec.call(
+        client, "POST /assignments/{id}/export-pdf", "POST", f"/assignments/{assignment_id}/export-pdf", admin_token
+    )
+
+
+async def run_load(args, base_url: str, issuer: LocalIssuer) -> tuple[list, float]:
+    rec = Recorder()
+    admin_token = issuer.token("loadtest|admin", "admin@loadtest.local", "Load Test Admin")
+    students = [
+        (issuer.token(f"loadtest|student{i}", f"student{i}@loadtest.local", f"Student {i}"), f"student{i}@loadtest.local")
+        for i in range(args.users)
+    ]
+
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.request_timeout, limits=limits) as client:
+        assignment_id = await setup_assignment(client, rec, admin_token, [email for _, email in students], args.questions)
+
+        gate = asyncio.Semaphore(args.concurrency)
+
+        async def student(token: str):
+            async with gate:
+                await assignment_session(client, rec, token, assignment_id, args.assignment_turns)
+                await free_chat(client, rec, token, args.turns, args.stream_every)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(student(token) for token, _ in students))
+        for _ in range(args.exports):
+            await export_pdf(client, rec, admin_token, assignment_id)
+        wall = time.perf_counter() - start
+
+        resp = await rec.call(client, "GET /admin/metrics", "GET", "/admin/metrics", admin_token)
+        if resp is not None and args.verbose:
+            print(json.dumps(resp.json(), indent=2, default=str))
+
+    return rec.report(wall), wall
+
+
+# ========== PROCESSES ==========
+
+def start_mongod(dbpath: str, port: int) -> subprocess.Popen:
+    mongod = shutil.which("mongod")
+    if not mongod:
+        raise SystemExit("mongod not found on PATH; install MongoDB or pass --mongodb-url")
+    return subprocess.Popen(
+        [mongod, "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+        stdout=subprocess.DEVNULL
+    )
+
+
+def wait_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise SystemExit(f"Timed out waiting for {url}")
+
+
+def wait_mongo(client: MongoClient, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            client.admin.command("ping")
+            return
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def seed_admin(db):
+    db.users.update_one(
+        {"auth0_id": "loadtest|admin"},
+        {"$set": {
+            "auth0_id": "loadtest|admin",
+            "username": "Load Test Admin",
+            "email": "admin@loadtest.local",
+            "is_admin": True,
+            "is_grader": True,
+            "created_at": datetime.now(timezone.utc),
+            "last_login": datetime.now(timezone.utc)
+        }},
+        upsert=True
+    )
+
+
+def app_environment(args, stub_url: str, mongodb_url: str, db_name: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_BASE_URL": f"{stub_url}/v1",
+        "MODEL_ID": "stub-model",
+        "SUMMARIZE_MODEL_ID": "stub-mini",
+        "SECRET_KEY": "loadtest",
+        "ALGORITHM": "RS256",
+        "AUTH0_DOMAIN": ISSUER_DOMAIN,
+        "AUTH0_API_AUDIENCE": AUDIENCE,
+        "JWKS_URL": f"{stub_url}/.well-known/jwks.json",
+        "FRONTEND_URL": "http://localhost:3000",
+        "MONGODB_URL": mongodb_url,
+        "MONGODB_CLIENT": db_name
+    })
+    if not args.keep_rate_limits:
+        env["RATE_LIMIT_POLICIES"] = json.dumps({
+            path: {"scope": scope, "limit": 10 ** 9, "window": 60}
+            for path, scope in (("/chat/start", "start"), ("/chat", "chat"), ("/chat/stream", "chat"))
+        })
+    return env
+
+
+def print_report(rows: list, wall: float):
+    print(f"\nWall time: {wall:.1f}s")
+    print(f"{'route':<56} {'count':>7} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'req/s':>8}")
+    for row in rows:
+        print(
+            f"{row['route']:<56} {row['count']:>7} {row['errors']:>5} {row['p50_ms']:>9.1f} "
+            f"{row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['max_ms']:>9.1f} {row['rps']:>8.2f}"
+        )
+    for row in rows:
+        if row["error_breakdown"]:
+            print(f"  errors for {row['route']}: {row['error_breakdown']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end ALAASKA load test")
+    parser.add_argument("--users", type=int, default=20, help="virtual students")
+    parser.add_argument("--concurrency", type=int, default=10, help="students active at once")
+    parser.add_argument("--turns", type=int, default=50, help="messages in the free-form chat")
+    parser.add_argument("--stream-every", type=int, default=5, help="send every Nth free-form message via /chat/stream (0 = never)")
+    parser.add_argument("--questions", type=int, default=3)
+    parser.add_argument("--assignment-turns", type=int, default=3, help="messages per assignment question")
+    parser.add_argument("--exports", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the app")
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument("--mongodb-url", default="mongodb://127.0.0.1:27017")
+    parser.add_argument("--start-mongod", action="store_true", help="run a throwaway mongod in a temp dir")
+    parser.add_argument("--keep-db", action="store_true")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="use the app's real rate limits")
+    parser.add_argument("--stub-args", default="", help="extra arguments for stub_openai, e.g. \"--latency-ms 300 --error-rate 0.05\"")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="print /admin/metrics after the run")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="alaaska-loadtest-")
+    processes = []
+    issuer = LocalIssuer(ISSUER_DOMAIN, AUDIENCE)
+    jwks_file = os.path.join(workdir, "jwks.json")
+    issuer.write_jwks(jwks_file)
+    db_name = f"alaaska_loadtest_{uuid.uuid4().hex[:8]}"
+    repo_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    try:
+        mongodb_url = args.mongodb_url
+        if args.start_mongod:
+            dbpath = os.path.join(workdir, "db")
+            os.makedirs(dbpath)
+            mongo_port = free_port()
+            processes.append(start_mongod(dbpath, mongo_port))
+            mongodb_url = f"mongodb://127.0.0.1:{mongo_port}"
+
+        mongo = MongoClient(mongodb_url)
+        wait_mongo(mongo)
+        seed_admin(mongo[db_name])
+
+        stub_port = free_port()
+        stub_url = f"http://127.0.0.1:{stub_port}"
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "backend.benchmarks.stub_openai", "--port", str(stub_port), "--jwks-file", jwks_file]
+            + args.stub_args.split(),
+            cwd=repo_root
+        ))
+        wait_ready(f"{stub_url}/stats")
+
+        app_port = free_port()
+        app_url = f"http://127.0.0.1:{app_port}"
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1", "--port", str(app_port),
+             "--workers", str(args.workers), "--log-level", "warning"],
+            cwd=repo_root,
+            env=app_environment(args, stub_url, mongodb_url, db_name)
+        ))
+        wait_ready(f"{app_url}/")
+
+        rows, wall = asyncio.run(run_load(args, app_url, issuer))
+        print_report(rows, wall)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"args": vars(args), "wall_seconds": wall, "routes": rows}, f, indent=2)
+
+        if not args.keep_db:
+            mongo.drop_database(db_name)
+        mongo.close()
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
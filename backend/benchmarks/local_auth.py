@@ -0,0 +1,64 @@
+# local_auth.py
+"""
+Locally signed JWTs for load tests.
+
+LocalIssuer generates an RSA key pair, publishes the public half as a JWKS document
+(served by stub_openai.py) and signs RS256 access tokens that pass
+backend.auth.verify_token when the app runs with:
+    AUTH0_DOMAIN=<issuer domain>, AUTH0_API_AUDIENCE=<audience>, ALGORITHM=RS256,
+    JWKS_URL=<stub>/.well-known/jwks.json
+"""
+import base64
+import json
+import time
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwt
+
+
+def b64url_uint(value: int) -> str:
+    data = value.to_bytes((value.bit_length() + 7) // 8, "big")
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+class LocalIssuer:
+    def __init__(self, domain: str, audience: str, kid: str = "loadtest-key"):
+        self.domain = domain
+        self.audience = audience
+        self.kid = kid
+        self._key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self._private_pem = self._key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()
+        ).decode()
+
+    def jwks(self) -> dict:
+        numbers = self._key.public_key().public_numbers()
+        return {
+            "keys": [{
+                "kty": "RSA",
+                "kid": self.kid,
+                "use": "sig",
+                "alg": "RS256",
+                "n": b64url_uint(numbers.n),
+                "e": b64url_uint(numbers.e)
+            }]
+        }
+
+    def write_jwks(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.jwks(), f)
+
+    def token(self, sub: str, email: str, name: str, ttl_seconds: int = 3600) -> str:
+        now = int(time.time())
+        claims = {
+            "iss": f"https://{self.domain}/",
+            "aud": self.audience,
+            "sub": sub,
+            "email": email,
+            "name": name,
+            "iat": now,
+            "exp": now + ttl_seconds
+        }
+        return jwt.encode(claims, self._private_pem, algorithm="RS256", headers={"kid": self.kid})
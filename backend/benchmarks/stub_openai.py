@@ -0,0 +1,181 @@
+# stub_openai.py
+"""
+Local OpenAI-compatible stub for load tests.
+
+Serves POST /v1/chat/completions (plain and streaming, with usage) with configurable
+latency and error injection, plus GET /.well-known/jwks.json for locally signed
+tokens (see local_auth.py). Point the app at it with
+    OPENAI_BASE_URL=http://127.0.0.1:<port>/v1
+    JWKS_URL=http://127.0.0.1:<port>/.well-known/jwks.json
+
+Usage (from the repository root):
+    python -m backend.benchmarks.stub_openai --port 8100 --latency-ms 800 --jitter-ms 400 \\
+        --token-delay-ms 20 --error-rate 0.02 --jwks-file /tmp/jwks.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+REPLY_WORDS = (
+    "That is a good start. Before we go further, what do you think the next step should be? "
+    "Try writing down what you already know and what the question is asking you to find."
+).split()
+
+
+class StubSettings:
+    latency_ms = 800.0         # time to first token / full response overhead
+    jitter_ms = 400.0          # uniform extra latency in [0, jitter_ms]
+    slow_rate = 0.0            # fraction of calls that take slow_ms extra (tail latency)
+    slow_ms = 5000.0
+    token_delay_ms = 20.0      # delay between streamed chunks
+    reply_words = 40
+    error_rate = 0.0           # fraction of calls answered with error_status
+    error_status = 500
+    jwks: dict = {"keys": []}
+
+
+settings = StubSettings()
+counters = {"requests": 0, "streams": 0, "errors": 0}
+
+app = FastAPI()
+
+
+def estimate_tokens(messages: list) -> int:
+    return sum(len(str(m.get("content") or "")) // 4 + 4 for m in messages)
+
+
+def reply_text() -> str:
+    words = [REPLY_WORDS[i % len(REPLY_WORDS)] for i in range(settings.reply_words)]
+    return " ".join(words)
+
+
+async def simulated_latency():
+    delay = settings.latency_ms + random.uniform(0, settings.jitter_ms)
+    if settings.slow_rate and random.random() < settings.slow_rate:
+        delay += settings.slow_ms
+    await asyncio.sleep(delay / 1000)
+
+
+def injected_error() -> JSONResponse | None:
+    if not settings.error_rate or random.random() >= settings.error_rate:
+        return None
+    counters["errors"] += 1
+    headers = {"retry-after": "1"} if settings.error_status == 429 else {}
+    return JSONResponse(
+        status_code=settings.error_status,
+        content={"error": {"message": "Injected error", "type": "server_error", "code": None}},
+        headers=headers
+    )
+
+
+@app.get("/.well-known/jwks.json")
+async def jwks():
+    return settings.jwks
+
+
+@app.get("/stats")
+async def stats():
+    return counters
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    counters["requests"] += 1
+    model = body.get("model", "stub")
+    prompt_tokens = estimate_tokens(body.get("messages", []))
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+
+    await simulated_latency()
+    error = injected_error()
+    if error is not None:
+        return error
+
+    text = reply_text()
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": len(text) // 4,
+        "total_tokens": prompt_tokens + len(text) // 4
+    }
+
+    if not body.get("stream"):
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        }
+
+    counters["streams"] += 1
+    include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+    def chunk(delta: dict, finish_reason: str | None = None, chunk_usage: dict | None = None) -> str:
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [] if chunk_usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+        if chunk_usage:
+            payload["usage"] = chunk_usage
+        return f"data: {json.dumps(payload)}\n\n"
+
+    async def events():
+        yield chunk({"role": "assistant", "content": ""})
+        for word in text.split():
+            await asyncio.sleep(settings.token_delay_ms / 1000)
+            yield chunk({"content": word + " "})
+        yield chunk({}, finish_reason="stop")
+        if include_usage:
+            yield chunk({}, chunk_usage=usage)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float, default=settings.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=settings.jitter_ms)
+    parser.add_argument("--slow-rate", type=float, default=settings.slow_rate)
+    parser.add_argument("--slow-ms", type=float, default=settings.slow_ms)
+    parser.add_argument("--token-delay-ms", type=float, default=settings.token_delay_ms)
+    parser.add_argument("--reply-words", type=int, default=settings.reply_words)
+    parser.add_argument("--error-rate", type=float, default=settings.error_rate)
+    parser.add_argument("--error-status", type=int, default=settings.error_status)
+    parser.add_argument("--jwks-file", help="JWKS document to serve at /.well-known/jwks.json")
+    args = parser.parse_args()
+
+    settings.latency_ms = args.latency_ms
+    settings.jitter_ms = args.jitter_ms
+    settings.slow_rate = args.slow_rate
+    settings.slow_ms = args.slow_ms
+    settings.token_delay_ms = args.token_delay_ms
+    settings.reply_words = args.reply_words
+    settings.error_rate = args.error_rate
+    settings.error_status = args.error_status
+    if args.jwks_file:
+        with open(args.jwks_file) as f:
+            settings.jwks = json.load(f)
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
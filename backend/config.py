@@ -1,4 +1,5 @@
 import os
+import json
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -8,12 +9,102 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 MODEL_ID = os.getenv("MODEL_ID")
+# Optional OpenAI-compatible endpoint (e.g. a local stub server for load tests)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
 SUMMARIZE_MODEL_ID = os.getenv("SUMMARIZE_MODEL_ID")
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN")
 AUTH0_API_AUDIENCE = os.getenv("AUTH0_API_AUDIENCE")
+# JWKS endpoint; defaults to the tenant's, override to verify locally signed tokens (load tests)
+JWKS_URL = os.getenv("JWKS_URL") or f"https://{AUTH0_DOMAIN}/.well-known/jwks.json"
 FRONTEND_URL = os.getenv("FRONTEND_URL","http://localhost:3000")
 
+# Maximum number of verified JWT payloads kept in memory (0 disables the cache)
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+# How long fetched Auth0 signing keys are used before refreshing
+JWKS_TTL_SECONDS = int(os.getenv("JWKS_TTL_SECONDS", "3600"))
+
+# User profile (role flags) cache lifetime, and minimum interval between last_login writes
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+LAST_LOGIN_UPDATE_MINUTES = int(os.getenv("LAST_LOGIN_UPDATE_MINUTES", "15"))
+
+# Rate limiting: "memory" (per worker) or "mongo" (shared across workers)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+
+# Per-route limits keyed by route path; routes with the same scope share one budget.
+# Override with a JSON object in RATE_LIMIT_POLICIES.
+DEFAULT_RATE_LIMIT_POLICIES = {
+    "/chat/start": {
+        "scope": "start", "limit": 5, "window": 60,
+        "detail": "Rate limit exceeded for starting new chats. Try again in a minute."
+    },
+    "/chat": {
+        "scope": "chat", "limit": 20, "window": 60,
+        "detail": "Rate limit exceeded for chat messages. Try again in a minute."
+    },
+    "/chat/stream": {
+        "scope": "chat", "limit": 20, "window": 60,
+        "detail": "Rate limit exceeded for chat messages. Try again in a minute."
+    },
+}
+RATE_LIMIT_POLICIES = json.loads(os.getenv("RATE_LIMIT_POLICIES") or "null") or DEFAULT_RATE_LIMIT_POLICIES
+
+# Daily LLM token budgets (0 = unlimited). Assignments can override theirs with a
+# "daily_token_budget" field on the assignment document.
+USER_DAILY_TOKEN_BUDGET = int(os.getenv("USER_DAILY_TOKEN_BUDGET", "0"))
+ASSIGNMENT_DAILY_TOKEN_BUDGET = int(os.getenv("ASSIGNMENT_DAILY_TOKEN_BUDGET", "0"))
+
+# LLM admission control (per worker): concurrent upstream calls, waiting requests,
+# how long a request may wait for a slot, and the Retry-After sent when shedding
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "200"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "20"))
+LLM_RETRY_AFTER = int(os.getenv("LLM_RETRY_AFTER", "10"))
+
+# LLM gateway: connection pool size, overall deadline per call (seconds, all retries
+# included), retry count, and circuit breaker threshold/cool-down
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_CALL_DEADLINE = float(os.getenv("LLM_CALL_DEADLINE", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+
+# Hedged chat completions: if a call has not finished after the LLM_HEDGE_PERCENTILE
+# latency of recent calls (never less than LLM_HEDGE_MIN_DELAY seconds), a second
+# request goes to LLM_FALLBACK_MODEL_ID (or the same model) and the first answer wins.
+# LLM_FALLBACK_MODEL_ID is also tried when the primary model fails or its circuit is open.
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "2"))
+LLM_FALLBACK_MODEL_ID = os.getenv("LLM_FALLBACK_MODEL_ID") or None
+
+# Where new conversations keep their messages: "embedded" (array in the conversation
+# document) or "collection" (one document per message in the messages collection)
+MESSAGE_STORAGE = os.getenv("MESSAGE_STORAGE", "embedded")
+
+# Prompt compaction: estimated token budget for the messages sent upstream and
+# how many recent turns are always sent verbatim
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "12000"))
+CONTEXT_KEEP_TURNS = int(os.getenv("CONTEXT_KEEP_TURNS", "6"))
+
+# PDF exports: worker processes rendering PDFs off the event loop
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", "2"))
+# Days a rendered per-student PDF fragment is kept after its last use (0 disables the cache)
+PDF_FRAGMENT_CACHE_DAYS = float(os.getenv("PDF_FRAGMENT_CACHE_DAYS", "14"))
+
+# Export jobs: concurrent jobs per app worker, how long finished jobs and their files
+# are kept, and after how long without a heartbeat a running job is taken over
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+EXPORT_JOB_RETENTION_HOURS = float(os.getenv("EXPORT_JOB_RETENTION_HOURS", "24"))
+EXPORT_JOB_STALE_SECONDS = int(os.getenv("EXPORT_JOB_STALE_SECONDS", "300"))
+EXPORT_MAX_ATTEMPTS = int(os.getenv("EXPORT_MAX_ATTEMPTS", "3"))
+# How large a CSV export may get before its spooled copy moves from memory to disk
+# (PDF_SPOOL_MAX_BYTES is still read for existing deployments)
+EXPORT_SPOOL_MAX_BYTES = int(
+    os.getenv("EXPORT_SPOOL_MAX_BYTES") or os.getenv("PDF_SPOOL_MAX_BYTES") or str(8 * 1024 * 1024)
+)
+
 def validate_environment():
     """Validate that all required environment variables are set"""
     required_vars = [
@@ -0,0 +1,163 @@
+# context_builder.py
+"""
+Builds the message list sent upstream for a chat turn.
+
+Long conversations are compacted so the prompt stays within CONTEXT_TOKEN_BUDGET:
+the pinned prefix (system prompt, plus the question greeting for assignment chats)
+and the last CONTEXT_KEEP_TURNS turns are always sent verbatim, and everything in
+between is replaced by a rolling summary generated with SUMMARIZE_MODEL_ID.
+
+The summary is cached on the conversation as
+    context_summary: {"text": str, "through_index": int}
+where through_index is the first message index NOT covered by the summary. It is
+extended incrementally only when the prompt would otherwise exceed the budget.
+The stored history itself is never modified.
+
+Prompts are laid out for provider-side prefix caching: the static instructions are
+the first message and byte-identical across chats, and question-specific context
+follows in its own message. Assignment chats stored before this layout (instructions
+and question in one system message) are split the same way when sent.
+"""
+import logging
+from backend.db_mongo import conversations_collection
+from backend.config import SUMMARIZE_MODEL_ID, CONTEXT_TOKEN_BUDGET, CONTEXT_KEEP_TURNS
+from backend import llm_gateway
+
+logger = logging.getLogger(__name__)
+
+# Opens the question-specific system message of assignment chats
+QUESTION_CONTEXT_HEADER = "The student needs to solve this assignment question:\n\n"
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a tutoring conversation between a student and ALAASKA, "
+    "a teaching assistant. Update the existing summary with the new messages. Keep what the student "
+    "has already understood, attempted, got wrong, and any hints or steps already given. "
+    "Be concise and factual; do not solve anything that was not solved in the conversation."
+)
+
+
+def estimate_tokens(message: dict) -> int:
+    """Rough token estimate (~4 characters per token plus per-message overhead)"""
+    return len(message.get("content") or "") // 4 + 4
+
+
+def estimate_total(messages: list) -> int:
+    return sum(estimate_tokens(m) for m in messages)
+
+
+def pinned_prefix_length(messages: list, is_assignment_chat: bool) -> int:
+    """Number of leading messages that must always be sent verbatim"""
+    count = 0
+    while count < len(messages) and messages[count].get("role") == "system":
+        count += 1
+    # Assignment chats open with an assistant greeting that restates the question
+    if is_assignment_chat and count < len(messages) and messages[count].get("role") == "assistant":
+        count += 1
+    return count
+
+
+def tail_start_index(messages: list, pinned: int, keep_turns: int) -> int:
+    """Index where the last keep_turns turns (each starting at a user message) begin"""
+    turns = 0
+    for idx in range(len(messages) - 1, pinned - 1, -1):
+        if messages[idx].get("role") == "user":
+            turns += 1
+            if turns == keep_turns:
+                return idx
+    return pinned
+
+
+def summary_message(text: str) -> dict:
+    return {"role": "system", "content": f"Summary of the earlier part of this conversation:\n{text}"}
+
+
+async def summarize_messages(previous_summary: str, messages: list) -> str:
+    """Fold messages into the previous summary"""
+    transcript = "\n\n".join(f"{m['role'].upper()}: {m.get('content', '')}" for m in messages)
+    resp = await llm_gateway.create_completion(
+        deadline=30,
+        model=SUMMARIZE_MODEL_ID,
+        messages=[
+            {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+            {
+                "role": "user",
+                "content": f"Existing summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"
+            }
+        ],
+        temperature=0.2
+    )
+    return (resp.choices[0].message.content or "").strip()
+
+
+def split_static_prefix(messages: list) -> list:
+    """Move the question context of a legacy assignment system prompt into its own message"""
+    if not messages or messages[0].get("role") != "system":
+        return messages
+    content = messages[0].get("content") or ""
+    static, marker, question = content.partition(f"\n\n{QUESTION_CONTEXT_HEADER}")
+    if not marker:
+        return messages
+    return [
+        {"role": "system", "content": static},
+        {"role": "system", "content": QUESTION_CONTEXT_HEADER + question}
+    ] + messages[1:]
+
+
+async def build_context(conversation: dict | None, messages: list) -> list:
+    """
+    Return the messages to send upstream for this turn.
+
+    conversation is the stored conversation document (None for a brand-new chat) and
+    messages is the full history including the new user message.
+    """
+    return split_static_prefix(await compact_messages(conversation, messages))
+
+
+async def compact_messages(conversation: dict | None, messages: list) -> list:
+    """Replace the middle of an over-budget conversation with the rolling summary"""
+    if conversation is None or estimate_total(messages) <= CONTEXT_TOKEN_BUDGET:
+        return messages
+
+    pinned = pinned_prefix_length(messages, conversation.get("is_assignment_chat", False))
+    prefix = messages[:pinned]
+
+    cached = conversation.get("context_summary") or {}
+    summary_text = cached.get("text", "")
+    through = cached.get("through_index", pinned)
+    if through < pinned or through > len(messages):
+        summary_text, through = "", pinned
+
+    def assemble(text: str, start: int) -> list:
+        return prefix + ([summary_message(text)] if text else []) + messages[start:]
+
+    candidate = assemble(summary_text, through)
+    if estimate_total(candidate) <= CONTEXT_TOKEN_BUDGET:
+        return candidate
+
+    # Shrink the verbatim tail until it fits (never below one turn)
+    keep_turns = max(CONTEXT_KEEP_TURNS, 1)
+    tail_start = tail_start_index(messages, pinned, keep_turns)
+    while keep_turns > 1 and estimate_total(prefix + messages[tail_start:]) > CONTEXT_TOKEN_BUDGET:
+        keep_turns -= 1
+        tail_start = tail_start_index(messages, pinned, keep_turns)
+
+    if tail_start <= through:
+        return assemble(summary_text, through)
+
+    try:
+        summary_text = await summarize_messages(summary_text, messages[through:tail_start])
+    except Exception as e:
+        logger.warning(f"Context summarization failed for {conversation.get('chat_id')}: {e}")
+        return assemble(summary_text, tail_start) if summary_text else prefix + messages[tail_start:]
+
+    # Caching the summary is best-effort; this turn uses it either way
+    try:
+        await conversations_collection.update_one(
+            {"chat_id": conversation["chat_id"]},
+            {"$set": {"context_summary": {"text": summary_text, "through_index": tail_start}}}
+        )
+    except Exception as e:
+        logger.warning(f"Failed to cache context summary for {conversation.get('chat_id')}: {e}")
+    logger.info(f"Compacted context for {conversation.get('chat_id')}: summarized messages {through}-{tail_start}")
+
+    return assemble(summary_text, tail_start)
@@ -41,6 +41,10 @@ db = mongo_client[MONGODB_CLIENT]
 users_collection = db["users"]
 conversations_collection = db["conversations"]
 messages_collection = db["messages"]
+rate_limits_collection = db["rate_limits"]
+token_usage_collection = db["token_usage"]
+export_jobs_collection = db["export_jobs"]
+pdf_fragments_collection = db["pdf_fragments"]
 
 async def test_connection():
     """Test the async MongoDB connection"""
@@ -66,6 +70,13 @@ async def create_indexes():
             ("updated_at", DESCENDING)
         ])
         await conversations_collection.create_index("chat_id", unique=True)
+        # Backs the sidebar listing: filter on user_id/is_deleted, keyset sort on (updated_at, chat_id)
+        await conversations_collection.create_index([
+            ("user_id", ASCENDING),
+            ("is_deleted", ASCENDING),
+            ("updated_at", DESCENDING),
+            ("chat_id", DESCENDING)
+        ])
         await conversations_collection.create_index([
             ("auth0_id", ASCENDING),
             ("chat_id", ASCENDING)
@@ -76,9 +87,24 @@ async def create_indexes():
             ("chat_id", ASCENDING),
             ("timestamp", ASCENDING)
         ])
+        await messages_collection.create_index([
+            ("chat_id", ASCENDING),
+            ("seq", ASCENDING)
+        ], unique=True)
         await messages_collection.create_index("chat_id")
         await messages_collection.create_index("auth0_id")
         
+        # Rate limit buckets expire on their own
+        await rate_limits_collection.create_index("expires_at", expireAfterSeconds=0)
+        await token_usage_collection.create_index("expires_at", expireAfterSeconds=0)
+
+        # Export jobs: claimed oldest-first by status; expired ones are removed by the
+        # export workers (not TTL, their GridFS artifacts have to go too)
+        await export_jobs_collection.create_index("job_id", unique=True)
+        await export_jobs_collection.create_index([("status", ASCENDING), ("created_at", ASCENDING)])
+        await export_jobs_collection.create_index("expires_at")
+        await pdf_fragments_collection.create_index("expires_at", expireAfterSeconds=0)
+        
         logger.info("Database indexes created successfully")
         return True
     except Exception as e:
@@ -0,0 +1,368 @@
+# export_jobs.py
+"""
+Asynchronous export jobs.
+
+Exports that can outgrow a single HTTP request (assignment PDFs, the data_analysis
+CSVs) are submitted as jobs instead:
+- a job document in export_jobs records kind, params, status
+  (queued -> running -> completed | failed) and progress {done, total}
+- each app worker runs EXPORT_WORKERS job loops that claim the oldest queued job
+  atomically; a running job whose heartbeat is older than EXPORT_JOB_STALE_SECONDS
+  (its worker died) is claimed again, up to EXPORT_MAX_ATTEMPTS times
+- finished artifacts are stored in GridFS (bucket "export_artifacts") so any worker
+  can serve the download
+- finished jobs and their artifacts are deleted EXPORT_JOB_RETENTION_HOURS after
+  they finish
+"""
+from fastapi import HTTPException
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo import ASCENDING, ReturnDocument
+from gridfs.errors import NoFile
+from datetime import datetime, timedelta, timezone
+from tempfile import SpooledTemporaryFile
+import asyncio
+import io
+import logging
+import os
+import socket
+import time
+import uuid
+from backend.db_mongo import db, export_jobs_collection, users_collection
+from backend.db_assignments import assignments_collection, student_assignments_collection
+from backend.data_analysis import write_conversations_csv, write_users_csv, write_messages_csv
+from backend.pdf_generator import render_pdf_to_file
+from backend.pdf_fragment_cache import pdf_fragment_cache
+from backend.config import (
+    FRONTEND_URL, EXPORT_WORKERS, EXPORT_JOB_RETENTION_HOURS, EXPORT_JOB_STALE_SECONDS,
+    EXPORT_MAX_ATTEMPTS, EXPORT_SPOOL_MAX_BYTES
+)
+
+logger = logging.getLogger(__name__)
+
+artifacts_bucket = AsyncIOMotorGridFSBucket(db, bucket_name="export_artifacts")
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+POLL_SECONDS = 5
+HEARTBEAT_SECONDS = 10
+PROGRESS_MIN_INTERVAL = 1
+GC_INTERVAL_SECONDS = 600
+UPLOAD_CHUNK_SIZE = 255 * 1024
+
+PDF_EXPORT = "assignment_pdf"
+CSV_EXPORTS = ("conversations_csv", "users_csv", "messages_csv")
+
+
+def now_utc() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# ========== EXPORT DATA ==========
+
+async def load_assignment_export(assignment_id: str) -> tuple[dict, list]:
+    """Assignment and per-student submission data for the Gradescope PDF"""
+    assignment = await assignments_collection.find_one({"assignment_id": assignment_id})
+    if not assignment:
+        raise HTTPException(status_code=404, detail="Assignment not found")
+
+    # Get all student submissions
+    submissions = await student_assignments_collection.find(
+        {"assignment_id": assignment_id},
+        {
+            "_id": 0,
+            "student_email": 1,
+            "questions.number": 1,
+            "questions.marks": 1,
+            "questions.student_solution": 1,
+            "questions.chat_id": 1,
+            "questions.submitted_at": 1
+        }
+    ).to_list(length=None)
+
+    # Get all student names in one query
+    emails = list({submission["student_email"] for submission in submissions})
+    names = {
+        user_doc["email"]: user_doc.get("username", "Unknown")
+        async for user_doc in users_collection.find(
+            {"email": {"$in": emails}},
+            {"_id": 0, "email": 1, "username": 1}
+        )
+    }
+
+    students_data = [
+        {
+            "name": names.get(submission["student_email"], "Unknown"),
+            "email": submission["student_email"],
+            "questions": [
+                {
+                    "number": question.get("number", "?"),
+                    "marks": question.get("marks", 0),
+                    "student_solution": question.get("student_solution"),
+                    "chat_id": question.get("chat_id"),
+                    "submitted_at": question.get("submitted_at")
+                }
+                for question in submission["questions"]
+            ]
+        }
+        for submission in submissions
+    ]
+
+    if not students_data:
+        raise HTTPException(status_code=404, detail="No submissions found for this assignment")
+    return assignment, students_data
+
+
+def pdf_filename(assignment_title: str) -> str:
+    safe_title = "".join(c if c.isalnum() or c in (' ', '-', '_') else '_' for c in assignment_title)
+    return f"{safe_title}_submissions.pdf"
+
+
+# ========== JOB RUNNERS ==========
+# Each runner returns (binary file positioned at 0, filename, content type)
+
+async def run_pdf_export(params: dict, progress):
+    assignment, students_data = await load_assignment_export(params["assignment_id"])
+    await progress(0, len(students_data))
+    pdf_file = await render_pdf_to_file(
+        assignment_title=assignment["title"],
+        students_data=students_data,
+        base_url=FRONTEND_URL,
+        progress=progress,
+        cache=pdf_fragment_cache
+    )
+    await progress(len(students_data), len(students_data))
+    return pdf_file, pdf_filename(assignment["title"]), "application/pdf"
+
+
+CSV_WRITERS = {
+    "conversations_csv": ("conversations", write_conversations_csv),
+    "users_csv": ("users", write_users_csv),
+    "messages_csv": ("messages", write_messages_csv),
+}
+
+async def run_csv_export(kind: str, progress):
+    name, writer = CSV_WRITERS[kind]
+    spool = SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES)
+    text = io.TextIOWrapper(spool, encoding="utf-8", newline="")
+    count = await writer(text, progress)
+    text.flush()
+    text.detach()
+    spool.seek(0)
+    await progress(count, count)
+    filename = f"{name}_export_{now_utc().strftime('%Y%m%d_%H%M%S')}.csv"
+    return spool, filename, "text/csv"
+
+
+async def run_export(job: dict, progress):
+    if job["kind"] == PDF_EXPORT:
+        return await run_pdf_export(job["params"], progress)
+    return await run_csv_export(job["kind"], progress)
+
+
+# ========== JOBS ==========
+
+async def create_export_job(kind: str, params: dict, created_by: str) -> dict:
+    if kind != PDF_EXPORT and kind not in CSV_EXPORTS:
+        raise HTTPException(status_code=400, detail=f"Unknown export kind: {kind}")
+
+    job = {
+        "job_id": str(uuid.uuid4()),
+        "kind": kind,
+        "params": params,
+        "status": "queued",
+        "progress": {"done": 0, "total": None},
+        "attempts": 0,
+        "created_by": created_by,
+        "created_at": now_utc()
+    }
+    await export_jobs_collection.insert_one(job)
+    export_workers.notify()
+    return job
+
+
+def job_summary(job: dict) -> dict:
+    """Public view of a job document"""
+    summary = {
+        field: job.get(field)
+        for field in (
+            "job_id", "kind", "params", "status", "progress", "created_by", "created_at",
+            "started_at", "finished_at", "error", "filename", "size", "expires_at"
+        )
+    }
+    if job.get("status") == "completed":
+        summary["download_url"] = f"/export-jobs/{job['job_id']}/download"
+    return summary
+
+
+async def claim_next_job() -> dict | None:
+    now = now_utc()
+    return await export_jobs_collection.find_one_and_update(
+        {
+            "$or": [
+                {"status": "queued"},
+                {"status": "running", "heartbeat_at": {"$lt": now - timedelta(seconds=EXPORT_JOB_STALE_SECONDS)}}
+            ]
+        },
+        {
+            "$set": {"status": "running", "worker_id": WORKER_ID, "started_at": now, "heartbeat_at": now},
+            "$inc": {"attempts": 1}
+        },
+        sort=[("created_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def finish_job(job_id: str, fields: dict) -> bool:
+    """Record the outcome; False if another worker has taken the job over meanwhile"""
+    finished_at = now_utc()
+    result = await export_jobs_collection.update_one(
+        {"job_id": job_id, "worker_id": WORKER_ID},
+        {"$set": {
+            **fields,
+            "finished_at": finished_at,
+            "expires_at": finished_at + timedelta(hours=EXPORT_JOB_RETENTION_HOURS)
+        }}
+    )
+    return result.matched_count == 1
+
+
+async def run_job(job: dict):
+    job_id = job["job_id"]
+    if job["attempts"] > EXPORT_MAX_ATTEMPTS:
+        await finish_job(job_id, {"status": "failed", "error": f"Gave up after {EXPORT_MAX_ATTEMPTS} attempts"})
+        return
+
+    last = {"done": None, "at": 0.0}
+
+    async def progress(done: int, total: int | None):
+        # Progress doubles as the heartbeat; write at most once a second (except the
+        # final count), and when unchanged only once the heartbeat is due
+        elapsed = time.monotonic() - last["at"]
+        if done == last["done"] and elapsed < HEARTBEAT_SECONDS:
+            return
+        if done != total and elapsed < PROGRESS_MIN_INTERVAL:
+            return
+        last.update(done=done, at=time.monotonic())
+        await export_jobs_collection.update_one(
+            {"job_id": job_id, "worker_id": WORKER_ID},
+            {"$set": {"progress": {"done": done, "total": total}, "heartbeat_at": now_utc()}}
+        )
+
+    logger.info(f"Export job {job_id} ({job['kind']}) started, attempt {job['attempts']}")
+    try:
+        artifact, filename, content_type = await run_export(job, progress)
+    except Exception as e:
+        detail = e.detail if isinstance(e, HTTPException) else f"{type(e).__name__}: {e}"
+        logger.error(f"Export job {job_id} failed: {detail}")
+        await finish_job(job_id, {"status": "failed", "error": str(detail)[:500]})
+        return
+
+    # Upload through an explicit stream so a failed upload's partial chunks can be removed
+    upload = artifacts_bucket.open_upload_stream(filename, metadata={"job_id": job_id, "content_type": content_type})
+    try:
+        while chunk := artifact.read(UPLOAD_CHUNK_SIZE):
+            await upload.write(chunk)
+        await upload.close()
+        artifact_id = upload._id
+        size = upload.length
+    except Exception as e:
+        logger.error(f"Export job {job_id} upload failed: {type(e).__name__}: {e}")
+        try:
+            await upload.abort()
+        except Exception as abort_error:
+            logger.error(f"Failed to remove partial upload for export job {job_id}: {abort_error}")
+        await finish_job(job_id, {"status": "failed", "error": f"Upload failed: {type(e).__name__}"})
+        return
+    finally:
+        artifact.close()
+
+    completed = await finish_job(job_id, {
+        "status": "completed",
+        "artifact_id": artifact_id,
+        "filename": filename,
+        "content_type": content_type,
+        "size": size
+    })
+    if not completed:
+        await delete_artifact(artifact_id)
+        return
+    logger.info(f"Export job {job_id} completed ({size} bytes)")
+
+
+async def delete_artifact(artifact_id):
+    try:
+        await artifacts_bucket.delete(artifact_id)
+    except NoFile:
+        pass
+
+
+async def collect_expired_jobs() -> int:
+    """Delete finished jobs past their retention, artifacts first"""
+    removed = 0
+    async for job in export_jobs_collection.find({"expires_at": {"$lt": now_utc()}}, {"job_id": 1, "artifact_id": 1}):
+        if job.get("artifact_id"):
+            await delete_artifact(job["artifact_id"])
+        await export_jobs_collection.delete_one({"_id": job["_id"]})
+        removed += 1
+    if removed:
+        logger.info(f"Removed {removed} expired export job(s)")
+    return removed
+
+
+async def open_artifact(job: dict):
+    """Async iterator over a completed job's artifact"""
+    grid_out = await artifacts_bucket.open_download_stream(job["artifact_id"])
+    while chunk := await grid_out.readchunk():
+        yield chunk
+
+
+class ExportWorkerPool:
+    """EXPORT_WORKERS job loops plus the retention GC loop for this app worker"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._tasks: list[asyncio.Task] = []
+        self._wake = asyncio.Event()
+
+    def notify(self):
+        self._wake.set()
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._job_loop()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._gc_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _job_loop(self):
+        while True:
+            try:
+                job = await claim_next_job()
+                if job is not None:
+                    await run_job(job)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Export worker error: {type(e).__name__}: {e}")
+
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def _gc_loop(self):
+        while True:
+            try:
+                await collect_expired_jobs()
+            except Exception as e:
+                logger.error(f"Export job GC failed: {type(e).__name__}: {e}")
+            await asyncio.sleep(GC_INTERVAL_SECONDS)
+
+
+export_workers = ExportWorkerPool(EXPORT_WORKERS)
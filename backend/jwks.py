@@ -0,0 +1,124 @@
+# jwks.py
+"""
+Async Auth0 JWKS provider.
+
+Keys are fetched with a shared httpx.AsyncClient, indexed by kid, and refreshed
+when older than JWKS_TTL_SECONDS. A token signed with an unknown kid (e.g. right
+after Auth0 rotates keys) triggers one forced refresh; concurrent requests wait on
+the same fetch instead of each hitting Auth0 (single-flight). If a refresh fails,
+the previously fetched keys keep being used and no fetch is retried for
+FAILED_FETCH_COOLDOWN seconds.
+"""
+import asyncio
+import logging
+import time
+from typing import Optional
+import httpx
+from backend.config import JWKS_URL, JWKS_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Forced (kid-miss) refreshes are not repeated more often than this, so tokens with
+# bogus kids cannot turn into a stream of requests to Auth0
+MIN_FORCED_REFRESH_INTERVAL = 30
+# After a failed fetch no refresh is attempted for this long: stale keys keep being
+# served, and without any keys requests fail immediately instead of queueing on fetches
+FAILED_FETCH_COOLDOWN = MIN_FORCED_REFRESH_INTERVAL
+
+
+class JWKSUnavailable(Exception):
+    pass
+
+
+class JWKSProvider:
+    def __init__(self, jwks_url: str, ttl_seconds: int = 3600, timeout: float = 10.0):
+        self.jwks_url = jwks_url
+        self.ttl_seconds = ttl_seconds
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._keys: dict[str, dict] = {}
+        self._fetched_at = 0.0
+        self._failed_at = float("-inf")
+        self._lock = asyncio.Lock()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        return self._client
+
+    def _is_stale(self) -> bool:
+        return not self._keys or time.monotonic() - self._fetched_at > self.ttl_seconds
+
+    async def _fetch(self):
+        logger.info(f"[AUTH] Fetching JWKS from: {self.jwks_url}")
+        response = await self.client.get(self.jwks_url)
+        response.raise_for_status()
+        jwks = response.json()
+
+        self._keys = {
+            key["kid"]: {field: key[field] for field in ("kty", "kid", "use", "n", "e") if field in key}
+            for key in jwks.get("keys", [])
+            if "kid" in key and "n" in key and "e" in key
+        }
+        self._fetched_at = time.monotonic()
+        logger.info(f"[AUTH] Successfully fetched JWKS with {len(self._keys)} keys")
+
+    async def refresh(self, force: bool = False):
+        """Refresh the key set if stale (or if force); concurrent callers share one fetch"""
+        requested_at = time.monotonic()
+        async with self._lock:
+            # Another caller refreshed while we were waiting for the lock
+            if self._fetched_at >= requested_at:
+                return
+            # A fetch failed recently (possibly the one we were waiting on)
+            if time.monotonic() - self._failed_at < FAILED_FETCH_COOLDOWN:
+                if self._keys:
+                    return
+                raise JWKSUnavailable("JWKS fetch failed recently, retrying later")
+            if force:
+                if self._keys and time.monotonic() - self._fetched_at < MIN_FORCED_REFRESH_INTERVAL:
+                    return
+            elif not self._is_stale():
+                return
+
+            try:
+                await self._fetch()
+            except Exception as e:
+                self._failed_at = time.monotonic()
+                logger.error(f"[AUTH] Failed to fetch JWKS: {type(e).__name__}: {str(e)}")
+                if not self._keys:
+                    raise
+
+    async def get_key(self, kid: str) -> Optional[dict]:
+        """Return the RSA key for kid, refreshing on TTL expiry or on an unknown kid"""
+        if self._is_stale():
+            await self.refresh()
+
+        key = self._keys.get(kid)
+        if key is None:
+            logger.warning(f"[AUTH] Unknown kid {kid}, forcing JWKS refresh")
+            await self.refresh(force=True)
+            key = self._keys.get(kid)
+        return key
+
+    def kids(self) -> list:
+        return list(self._keys)
+
+    async def warm_up(self):
+        """Prefetch keys at startup so the first request does not pay for the fetch"""
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.warning(f"[AUTH] JWKS warm-up failed, will retry on first request: {e}")
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+jwks_provider = JWKSProvider(
+    JWKS_URL,
+    ttl_seconds=JWKS_TTL_SECONDS
+)
@@ -0,0 +1,343 @@
+# llm_gateway.py
+"""
+Single entry point for all OpenAI calls.
+
+- one AsyncOpenAI client on a shared, tuned httpx connection pool
+- a deadline per call covering every attempt (LLM_CALL_DEADLINE by default)
+- bounded retries with exponential backoff and full jitter on 429/5xx/timeouts/
+  connection errors, honouring the upstream Retry-After header
+- a circuit breaker per model: after LLM_BREAKER_THRESHOLD consecutive upstream
+  failures calls fail fast with 503 for LLM_BREAKER_RESET seconds, then a single
+  trial call is let through to probe recovery
+- optional hedging and a fallback model for chat completions (complete_chat):
+  a slow call is raced against a second request once it exceeds the recent
+  LLM_HEDGE_PERCENTILE latency, and LLM_FALLBACK_MODEL_ID is tried when the
+  primary model fails
+- per-model prompt token counters including the provider-cached share
+  (usage.prompt_tokens_details.cached_tokens)
+"""
+from fastapi import HTTPException
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError, APITimeoutError
+from collections import deque
+import asyncio
+import httpx
+import logging
+import math
+import random
+import time
+from backend.config import (
+    OPENAI_API_KEY, OPENAI_BASE_URL, LLM_MAX_CONNECTIONS, LLM_CALL_DEADLINE, LLM_MAX_RETRIES,
+    LLM_BREAKER_THRESHOLD, LLM_BREAKER_RESET, LLM_HEDGE_ENABLED, LLM_HEDGE_PERCENTILE,
+    LLM_HEDGE_MIN_DELAY, LLM_FALLBACK_MODEL_ID
+)
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+LATENCY_WINDOW = 500
+HEDGE_MIN_SAMPLES = 20
+
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_CONNECTIONS,
+        keepalive_expiry=60
+    ),
+    timeout=httpx.Timeout(LLM_CALL_DEADLINE, connect=5.0)
+)
+
+# Retries are handled here, not by the SDK, so they share the call's deadline
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, http_client=http_client, max_retries=0)
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self, model: str):
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return
+        retry_after = max(1, math.ceil(self.reset_timeout - (time.monotonic() - self.opened_at)))
+        raise HTTPException(
+            status_code=503,
+            detail="The tutor is temporarily unavailable. Please try again shortly.",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self, model: str):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.error(f"LLM circuit opened for {model} after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+
+
+breakers: dict[str, CircuitBreaker] = {}
+
+def get_breaker(model: str) -> CircuitBreaker:
+    if model not in breakers:
+        breakers[model] = CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_RESET)
+    return breakers[model]
+
+
+# model -> durations (seconds) of recent non-streaming attempts; cancelled and timed-out
+# attempts count with the time they had run (a lower bound on their latency)
+latencies: dict[str, deque] = {}
+
+# model -> prompt token totals, to verify provider prompt-cache hit rates
+usage_counters: dict[str, dict] = {}
+
+hedge_counters = {
+    "calls": 0,
+    "hedged": 0,
+    "primary_wins": 0,
+    "hedge_wins": 0,
+    "fallbacks": 0
+}
+
+
+def record_latency(model: str, seconds: float):
+    latencies.setdefault(model, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+
+def cached_prompt_tokens(usage) -> int:
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", None) or 0
+
+
+def record_usage(model: str, usage):
+    """Count prompt and provider-cached prompt tokens of a completed call"""
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+    cached_tokens = cached_prompt_tokens(usage)
+    counters = usage_counters.setdefault(model, {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0})
+    counters["calls"] += 1
+    counters["prompt_tokens"] += prompt_tokens
+    counters["cached_tokens"] += cached_tokens
+    logger.debug(f"LLM usage for {model}: prompt_tokens={prompt_tokens} cached_tokens={cached_tokens}")
+
+
+def latency_percentile(model: str, percentile: float) -> float | None:
+    samples = latencies.get(model)
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+def hedge_delay(model: str) -> float:
+    """Seconds to wait for the primary call before sending the hedge"""
+    if len(latencies.get(model, ())) < HEDGE_MIN_SAMPLES:
+        return LLM_HEDGE_MIN_DELAY
+    return max(LLM_HEDGE_MIN_DELAY, latency_percentile(model, LLM_HEDGE_PERCENTILE))
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (APITimeoutError, APIConnectionError, asyncio.TimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code in RETRYABLE_STATUS
+
+
+def retry_after_seconds(error: Exception) -> float | None:
+    """Upstream Retry-After (seconds) if the error carries one"""
+    if not isinstance(error, APIStatusError):
+        return None
+    value = error.response.headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+async def create_completion(*, deadline: float | None = None, max_retries: int | None = None, **kwargs):
+    """
+    client.chat.completions.create with deadline, retries and circuit breaking.
+
+    For stream=True this returns the stream once the upstream has accepted the request;
+    only establishing the stream is retried. Non-retryable errors (e.g. 400) are raised
+    immediately; an open circuit raises HTTPException(503).
+    """
+    model = kwargs["model"]
+    deadline = LLM_CALL_DEADLINE if deadline is None else deadline
+    max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+    breaker = get_breaker(model)
+    expires = time.monotonic() + deadline
+
+    attempt = 0
+    while True:
+        breaker.before_call(model)
+        remaining = expires - time.monotonic()
+        started = time.monotonic()
+        try:
+            result = await client.chat.completions.create(timeout=max(remaining, 0.1), **kwargs)
+        except asyncio.CancelledError:
+            # e.g. the losing side of a hedge; never leave a half-open circuit waiting on us
+            breaker.trial_in_flight = False
+            # The call took at least this long; dropping it would bias the percentiles low
+            if not kwargs.get("stream"):
+                record_latency(model, time.monotonic() - started)
+            raise
+        except Exception as e:
+            if isinstance(e, (APITimeoutError, asyncio.TimeoutError)) and not kwargs.get("stream"):
+                record_latency(model, time.monotonic() - started)
+            if not is_retryable(e):
+                # The upstream answered (e.g. 400), so it is healthy even though it rejected the request
+                if isinstance(e, APIStatusError):
+                    breaker.record_success()
+                else:
+                    breaker.trial_in_flight = False
+                raise
+            breaker.record_failure(model)
+
+            delay = retry_after_seconds(e)
+            if delay is None:
+                delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+            remaining = expires - time.monotonic()
+            if attempt >= max_retries or delay >= remaining:
+                logger.error(f"LLM call to {model} failed after {attempt + 1} attempt(s): {type(e).__name__}: {e}")
+                raise
+            attempt += 1
+            logger.warning(f"LLM call to {model} failed ({type(e).__name__}), retry {attempt} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            continue
+
+        breaker.record_success()
+        if not kwargs.get("stream"):
+            record_latency(model, time.monotonic() - started)
+            record_usage(model, getattr(result, "usage", None))
+        return result
+
+
+def should_fall_back(error: Exception, model: str) -> bool:
+    if not LLM_FALLBACK_MODEL_ID or LLM_FALLBACK_MODEL_ID == model:
+        return False
+    if isinstance(error, HTTPException):
+        return error.status_code == 503  # circuit open
+    return is_retryable(error)
+
+
+async def hedged_completion(tried: set | None = None, **kwargs):
+    """
+    Race a slow call against a second request and return the first success.
+
+    Returns (response, hedged) where hedged tells whether a second request was sent.
+    The loser is cancelled; if both fail, the primary's error is raised. The models
+    called are added to tried (if given), also when the call fails.
+    """
+    model = kwargs["model"]
+    tried = set() if tried is None else tried
+    primary = asyncio.create_task(create_completion(**kwargs))
+    tried.add(model)
+    tasks = [primary]
+
+    # Cancelling this call (e.g. client disconnect or deadline) cancels the upstream requests
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=hedge_delay(model))
+        if done:
+            return primary.result(), False
+
+        hedge_counters["hedged"] += 1
+        hedge_model = LLM_FALLBACK_MODEL_ID or model
+        hedge = asyncio.create_task(create_completion(**{**kwargs, "model": hedge_model}))
+        tried.add(hedge_model)
+        tasks.append(hedge)
+        logger.info(f"Hedging slow call to {model} with {hedge_model}")
+        names = {primary: "primary_wins", hedge: "hedge_wins"}
+
+        pending = {primary, hedge}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    hedge_counters[names[task]] += 1
+                    return task.result(), True
+        return primary.result(), True
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def complete_chat(**kwargs):
+    """
+    Chat completion with hedging (LLM_HEDGE_ENABLED, non-streaming only) and a
+    fallback to LLM_FALLBACK_MODEL_ID when the primary model fails or is unavailable.
+    """
+    model = kwargs["model"]
+    tried = {model}
+    try:
+        if LLM_HEDGE_ENABLED and not kwargs.get("stream"):
+            hedge_counters["calls"] += 1
+            response, _ = await hedged_completion(tried, **kwargs)
+            return response
+        return await create_completion(**kwargs)
+    except Exception as e:
+        # A hedge that already went to the fallback model has had its chance
+        if LLM_FALLBACK_MODEL_ID in tried or not should_fall_back(e, model):
+            raise
+        hedge_counters["fallbacks"] += 1
+        logger.warning(f"Falling back from {model} to {LLM_FALLBACK_MODEL_ID}: {type(e).__name__}")
+        return await create_completion(**{**kwargs, "model": LLM_FALLBACK_MODEL_ID})
+
+
+def stats() -> dict:
+    calls = hedge_counters["calls"]
+    hedged = hedge_counters["hedged"]
+    return {
+        "circuits": {
+            model: {"state": breaker.state, "consecutive_failures": breaker.failures}
+            for model, breaker in breakers.items()
+        },
+        "latency_seconds": {
+            model: {
+                "p50": latency_percentile(model, 50),
+                "p95": latency_percentile(model, 95),
+                "p99": latency_percentile(model, 99),
+                "hedge_delay": hedge_delay(model)
+            }
+            for model in latencies
+        },
+        "prompt_cache": {
+            model: {
+                **counters,
+                "cache_hit_rate": counters["cached_tokens"] / counters["prompt_tokens"] if counters["prompt_tokens"] else 0.0
+            }
+            for model, counters in usage_counters.items()
+        },
+        "hedging": {
+            "enabled": LLM_HEDGE_ENABLED,
+            "fallback_model": LLM_FALLBACK_MODEL_ID,
+            **hedge_counters,
+            "hedge_rate": hedged / calls if calls else 0.0,
+            "hedge_win_rate": hedge_counters["hedge_wins"] / hedged if hedged else 0.0
+        }
+    }
+
+
+async def close():
+    await client.close()
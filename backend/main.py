@@ -6,9 +6,14 @@ from backend.config import validate_environment
 from backend.middleware import get_cors_middleware, add_security_headers, limit_request_size
 from backend.db_mongo import initialize_database, close_connection
 from backend.db_assignments import create_assignment_indexes
+from backend.jwks import jwks_provider
+from backend import llm_gateway
+from backend.pdf_generator import shutdown_pdf_executor
+from backend.export_jobs import export_workers
 from backend.routes_chat import router as chat_router
 from backend.routes_assignments import router as assignments_router
 from backend.routes_admin import router as admin_router  # Make sure this is imported
+from backend.routes_exports import router as exports_router
 
 # Validate environment variables
 validate_environment()
@@ -31,10 +36,17 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"Failed to initialize database: {e}")
         raise
+
+    await jwks_provider.warm_up()
+    export_workers.start()
     
     yield
     
     # Shutdown
+    await export_workers.stop()
+    await jwks_provider.close()
+    await llm_gateway.close()
+    shutdown_pdf_executor()
     try:
         await close_connection()
         logger.info("Database connection closed")
@@ -59,6 +71,7 @@ app.middleware("http")(limit_request_size)
 app.include_router(chat_router, tags=["chat"])
 app.include_router(assignments_router, tags=["assignments"])
 app.include_router(admin_router, tags=["admin"])  # This line must be present
+app.include_router(exports_router, tags=["exports"])
 
 @app.get("/")
 async def root():
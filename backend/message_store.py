@@ -0,0 +1,254 @@
+# message_store.py
+"""
+Read/write access to conversation messages.
+
+Messages are stored in one of two layouts, recorded per conversation in the
+"message_storage" field:
+
+- "embedded"   (legacy/default): a "messages" array inside the conversation document
+- "collection": one document per message in messages_collection, keyed by
+                (chat_id, seq) where seq is the message's index in the chat
+
+New conversations use MESSAGE_STORAGE from config. Existing embedded conversations
+can be moved over online with `python -m backend.migrate_messages`.
+"""
+from fastapi import HTTPException
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timezone
+import logging
+from backend.db_mongo import conversations_collection, messages_collection
+from backend.config import MESSAGE_STORAGE
+
+logger = logging.getLogger(__name__)
+
+EMBEDDED = "embedded"
+COLLECTION = "collection"
+
+MESSAGE_PROJECTION = {"_id": 0, "role": 1, "content": 1}
+
+
+def now_utc():
+    return datetime.now(timezone.utc)
+
+
+def uses_collection(conversation: dict) -> bool:
+    """True if this conversation's messages live in messages_collection"""
+    return conversation.get("message_storage") == COLLECTION
+
+
+def build_message_docs(chat_id: str, user_id: str, messages: list, start_seq: int = 0) -> list:
+    """Turn {role, content} dicts into per-message documents"""
+    timestamp = now_utc()
+    return [
+        {
+            "chat_id": chat_id,
+            "seq": start_seq + offset,
+            "auth0_id": user_id,
+            "role": msg["role"],
+            "content": msg.get("content", ""),
+            "timestamp": timestamp
+        }
+        for offset, msg in enumerate(messages)
+    ]
+
+
+async def create_conversation(conversation_doc: dict, messages: list):
+    """
+    Insert a new conversation with its initial messages using the configured layout.
+
+    conversation_doc must not contain "messages"; they are placed according to MESSAGE_STORAGE.
+    Raises DuplicateKeyError if the chat_id already exists.
+    """
+    doc = dict(conversation_doc)
+    doc["message_count"] = len(messages)
+    if MESSAGE_STORAGE == COLLECTION:
+        doc["message_storage"] = COLLECTION
+        await conversations_collection.insert_one(doc)
+        if messages:
+            await messages_collection.insert_many(
+                build_message_docs(doc["chat_id"], doc["user_id"], messages)
+            )
+    else:
+        doc["message_storage"] = EMBEDDED
+        doc["messages"] = messages
+        await conversations_collection.insert_one(doc)
+
+
+async def get_messages(conversation: dict) -> list:
+    """Return the full message list ({role, content}) for a conversation document"""
+    if not uses_collection(conversation):
+        return conversation.get("messages", [])
+
+    cursor = messages_collection.find(
+        {"chat_id": conversation["chat_id"]},
+        MESSAGE_PROJECTION
+    ).sort("seq", ASCENDING)
+    return await cursor.to_list(None)
+
+
+async def count_messages(conversation: dict) -> int:
+    """Total messages in a conversation; falls back to $size for legacy docs without message_count"""
+    if conversation.get("message_count") is not None:
+        return conversation["message_count"]
+    if uses_collection(conversation):
+        return await messages_collection.count_documents({"chat_id": conversation["chat_id"]})
+
+    result = await conversations_collection.aggregate([
+        {"$match": {"chat_id": conversation["chat_id"]}},
+        {"$project": {"_id": 0, "count": {"$size": {"$ifNull": ["$messages", []]}}}}
+    ]).to_list(1)
+    return result[0]["count"] if result else 0
+
+
+async def get_message_window(
+    conversation: dict,
+    limit: int | None = None,
+    before_index: int | None = None,
+    since_index: int | None = None
+) -> tuple[list, int, int]:
+    """
+    Read a contiguous range of messages without loading the whole history.
+
+    conversation may be loaded without its "messages" field. Returns
+    (messages, start_index, total):
+    - since_index: every message at index >= since_index (delta mode)
+    - otherwise the last `limit` messages before `before_index` (default: the end);
+      with neither limit nor before_index this is the full history
+    """
+    total = await count_messages(conversation)
+
+    if since_index is not None:
+        start, end = min(since_index, total), total
+    else:
+        end = total if before_index is None else max(0, min(before_index, total))
+        start = max(0, end - limit) if limit else 0
+
+    if end <= start:
+        return [], start, total
+
+    if uses_collection(conversation):
+        cursor = messages_collection.find(
+            {"chat_id": conversation["chat_id"], "seq": {"$gte": start, "$lt": end}},
+            MESSAGE_PROJECTION
+        ).sort("seq", ASCENDING)
+        return await cursor.to_list(None), start, total
+
+    doc = await conversations_collection.find_one(
+        {"chat_id": conversation["chat_id"]},
+        {"_id": 0, "chat_id": 1, "messages": {"$slice": [start, end - start]}}
+    )
+    return (doc or {}).get("messages", []), start, total
+
+
+async def append_messages(conversation: dict, new_messages: list, set_fields: dict) -> int:
+    """
+    Append messages to an existing conversation and return its new version.
+
+    The conversation update is guarded by the version that was read, so a concurrent
+    writer (another turn, or the migration flipping the layout) results in a 409.
+    """
+    chat_id = conversation["chat_id"]
+    expected_version = conversation.get("version")  # None also matches legacy docs without a version
+    query = {
+        "chat_id": chat_id,
+        "user_id": conversation["user_id"],
+        "is_deleted": False,
+        "version": expected_version,
+        "message_storage": conversation.get("message_storage")
+    }
+
+    update = {
+        "$set": {**set_fields, "updated_at": now_utc()},
+        "$inc": {"version": 1}
+    }
+    if conversation.get("message_count") is None:
+        # Legacy embedded doc: start tracking the count from the array we just read
+        update["$set"]["message_count"] = len(conversation.get("messages", [])) + len(new_messages)
+    else:
+        update["$inc"]["message_count"] = len(new_messages)
+    if not uses_collection(conversation):
+        update["$push"] = {"messages": {"$each": new_messages}}
+
+    result = await conversations_collection.update_one(query, update)
+    if result.matched_count == 0:
+        logger.warning(f"Concurrent update detected on conversation {chat_id}")
+        raise HTTPException(
+            status_code=409,
+            detail="Conversation was updated by another request. Please refresh and try again."
+        )
+
+    new_version = (expected_version or 0) + 1
+
+    if uses_collection(conversation):
+        # The version guard above reserved seq numbers [message_count, message_count + n)
+        start_seq = conversation.get("message_count", 0)
+        try:
+            await messages_collection.insert_many(
+                build_message_docs(chat_id, conversation["user_id"], new_messages, start_seq)
+            )
+        except Exception as e:
+            await release_reserved_seqs(chat_id, new_version, start_seq, len(new_messages))
+            if isinstance(e, DuplicateKeyError):
+                raise HTTPException(
+                    status_code=409,
+                    detail="Conversation was updated by another request. Please refresh and try again."
+                )
+            raise
+
+    return new_version
+
+
+async def release_reserved_seqs(chat_id: str, version: int, start_seq: int, count: int):
+    """
+    Undo a seq reservation whose messages could not be inserted, so message_count does
+    not run ahead of the stored messages. Only applies if no later write has happened.
+    """
+    try:
+        # Remove messages of the range inserted before the failure
+        await messages_collection.delete_many(
+            {"chat_id": chat_id, "seq": {"$gte": start_seq, "$lt": start_seq + count}}
+        )
+        await conversations_collection.update_one(
+            {"chat_id": chat_id, "version": version},
+            {"$inc": {"message_count": -count, "version": 1}}
+        )
+    except Exception as e:
+        logger.error(f"Failed to release seq {start_seq}-{start_seq + count} of conversation {chat_id}: {e}")
+
+
+async def iter_all_messages():
+    """Yield every stored message (both layouts) as a flat export row"""
+    cursor = messages_collection.find({}, {"_id": 0}).sort([("chat_id", ASCENDING), ("seq", ASCENDING)])
+
+    # Message docs count only once their conversation has switched to the collection
+    # layout (a migration skipped mid-copy leaves copies of still-embedded messages).
+    # Both cursors are sorted by chat_id, so walk them together.
+    collection_chats = conversations_collection.find(
+        {"message_storage": COLLECTION}, {"_id": 0, "chat_id": 1}
+    ).sort("chat_id", ASCENDING)
+    collection_chat = ""
+    exhausted = False
+    async for message in cursor:
+        while not exhausted and collection_chat < message["chat_id"]:
+            try:
+                collection_chat = (await anext(collection_chats))["chat_id"]
+            except StopAsyncIteration:
+                exhausted = True
+        if collection_chat == message["chat_id"]:
+            yield message
+
+    cursor = conversations_collection.find(
+        {"message_storage": {"$ne": COLLECTION}},
+        {"_id": 0, "chat_id": 1, "user_id": 1, "messages": 1, "updated_at": 1}
+    ).sort("chat_id", ASCENDING)
+    async for conv in cursor:
+        for seq, msg in enumerate(conv.get("messages", [])):
+            yield {
+                "chat_id": conv["chat_id"],
+                "seq": seq,
+                "auth0_id": conv.get("user_id"),
+                "role": msg.get("role"),
+                "content": msg.get("content", ""),
+                "timestamp": msg.get("timestamp")
+            }
@@ -9,6 +9,7 @@ def get_cors_middleware():
         "allow_credentials": True,
         "allow_methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
         "allow_headers": ["*"],
+        "expose_headers": ["X-Next-Cursor"],
     }
 
 async def add_security_headers(request: Request, call_next):
@@ -0,0 +1,108 @@
+# migrate_messages.py
+"""
+Online backfill of embedded conversation messages into the messages collection.
+
+Usage (from the repository root):
+    python -m backend.migrate_messages [--batch-size 100] [--limit N] [--dry-run]
+
+Safe to run while the API is serving traffic and safe to re-run:
+- message documents are upserted by (chat_id, seq), so partial runs are idempotent
+- the conversation is only switched to the "collection" layout if its version has not
+  changed since it was read; conversations that received a new turn mid-copy are
+  skipped and picked up on the next pass (their copied message documents are ignored
+  by exports until then, see message_store.iter_all_messages)
+"""
+import argparse
+import asyncio
+import logging
+from pymongo import ReplaceOne, ASCENDING
+from backend.db_mongo import (
+    initialize_database, close_connection, conversations_collection, messages_collection
+)
+from backend.message_store import COLLECTION, build_message_docs
+
+logger = logging.getLogger(__name__)
+
+
+async def migrate_conversation(conv: dict, dry_run: bool = False) -> bool:
+    """Move one conversation's embedded messages out; returns True if it was switched over"""
+    messages = conv.get("messages", [])
+    if dry_run:
+        return True
+
+    if messages:
+        docs = build_message_docs(conv["chat_id"], conv.get("user_id"), messages)
+        await messages_collection.bulk_write(
+            [ReplaceOne({"chat_id": d["chat_id"], "seq": d["seq"]}, d, upsert=True) for d in docs],
+            ordered=False
+        )
+
+    result = await conversations_collection.update_one(
+        {
+            "_id": conv["_id"],
+            "version": conv.get("version"),
+            "message_storage": {"$ne": COLLECTION}
+        },
+        {
+            "$set": {"message_storage": COLLECTION, "message_count": len(messages)},
+            "$unset": {"messages": ""},
+            "$inc": {"version": 1}
+        }
+    )
+    return result.modified_count == 1
+
+
+async def migrate(batch_size: int = 100, limit: int | None = None, dry_run: bool = False) -> dict:
+    """Backfill all embedded conversations in _id order, batch_size documents at a time"""
+    stats = {"scanned": 0, "migrated": 0, "skipped": 0}
+    last_id = None
+
+    while limit is None or stats["scanned"] < limit:
+        query = {"message_storage": {"$ne": COLLECTION}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+
+        batch = await conversations_collection.find(
+            query,
+            {"_id": 1, "chat_id": 1, "user_id": 1, "messages": 1, "version": 1}
+        ).sort("_id", ASCENDING).limit(batch_size).to_list(batch_size)
+
+        if not batch:
+            break
+
+        for conv in batch:
+            stats["scanned"] += 1
+            if await migrate_conversation(conv, dry_run):
+                stats["migrated"] += 1
+            else:
+                stats["skipped"] += 1
+            if limit is not None and stats["scanned"] >= limit:
+                break
+
+        last_id = batch[-1]["_id"]
+        logger.info(f"Migrated {stats['migrated']} / scanned {stats['scanned']} conversations")
+
+    return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Move embedded chat messages into the messages collection")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=None, help="Stop after scanning this many conversations")
+    parser.add_argument("--dry-run", action="store_true", help="Only count conversations that would be migrated")
+    args = parser.parse_args()
+
+    await initialize_database()
+    try:
+        stats = await migrate(args.batch_size, args.limit, args.dry_run)
+        print(
+            f"Scanned {stats['scanned']} conversations: {stats['migrated']} migrated, "
+            f"{stats['skipped']} skipped (changed during copy, re-run to pick them up)"
+        )
+    finally:
+        await close_connection()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(main())
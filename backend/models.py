@@ -16,6 +16,7 @@ class Token(BaseModel):
 class ChatRequest(BaseModel):
     message: str = Field(..., max_length=10000, min_length=1)
     chat_id: str | None = None
+    delta: bool = False  # Return only the messages appended by this turn instead of the full history
     
     @field_validator('message')
     @classmethod
@@ -89,6 +89,7 @@ class CreateAssignmentRequest(BaseModel):
     allowed_students: List[str]
     pre_quiz_id: Optional[str] = None
     post_quiz_id: Optional[str] = None
+    daily_token_budget: Optional[int] = Field(default=None, ge=0)  # Per student per day; None uses the server default
 
 class MarkSolutionRequest(BaseModel):
     solution: str
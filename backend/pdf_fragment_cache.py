@@ -0,0 +1,62 @@
+# pdf_fragment_cache.py
+"""
+Shared cache of rendered per-student PDF fragments.
+
+Fragments are stored in pdf_fragments keyed by pdf_generator.fragment_key (a hash
+of the student's name, email and answers plus the assignment title and layout
+version), so re-exporting an assignment only re-renders students whose submissions
+changed. Entries expire PDF_FRAGMENT_CACHE_DAYS after they were last used.
+"""
+from bson import Binary
+from pymongo.errors import BulkWriteError
+from datetime import datetime, timedelta, timezone
+import logging
+from backend.db_mongo import pdf_fragments_collection
+from backend.config import PDF_FRAGMENT_CACHE_DAYS
+
+logger = logging.getLogger(__name__)
+
+
+class MongoFragmentCache:
+    def __init__(self, ttl_days: float):
+        self.ttl_days = ttl_days
+        self.hits = 0
+        self.misses = 0
+
+    def _expires_at(self) -> datetime:
+        return datetime.now(timezone.utc) + timedelta(days=self.ttl_days)
+
+    async def iter_many(self, keys: set):
+        """Yield (key, fragment) for the cached keys, one document at a time"""
+        found = []
+        async for doc in pdf_fragments_collection.find({"_id": {"$in": list(keys)}}, {"pdf": 1}):
+            found.append(doc["_id"])
+            yield doc["_id"], bytes(doc["pdf"])
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        if found:
+            await pdf_fragments_collection.update_many(
+                {"_id": {"$in": found}},
+                {"$set": {"expires_at": self._expires_at()}}
+            )
+
+    async def put_many(self, fragments: dict):
+        expires_at = self._expires_at()
+        try:
+            await pdf_fragments_collection.insert_many(
+                [
+                    {"_id": key, "pdf": Binary(fragment), "size": len(fragment), "expires_at": expires_at}
+                    for key, fragment in fragments.items()
+                ],
+                ordered=False
+            )
+        except BulkWriteError as e:
+            # Another export rendered the same students concurrently; anything else is a real error
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                logger.error(f"Failed to cache PDF fragments: {e.details}")
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+pdf_fragment_cache = MongoFragmentCache(PDF_FRAGMENT_CACHE_DAYS) if PDF_FRAGMENT_CACHE_DAYS > 0 else None
@@ -5,24 +5,227 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
 from reportlab.lib.enums import TA_LEFT
 from reportlab.lib import colors
 from reportlab.platypus import Table, TableStyle
+from pypdf import PdfReader, PdfWriter
 from io import BytesIO
+from collections import Counter
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
 import markdown2
 import re
 from datetime import datetime
+from backend.config import PDF_RENDER_WORKERS
 
+logger = logging.getLogger(__name__)
+
+FILE_CHUNK_SIZE = 64 * 1024
+# Newly rendered fragments written to the cache per put_many call
+CACHE_WRITE_BATCH = 50
+
+# Bump when the page layout changes so cached student fragments are re-rendered
+FRAGMENT_LAYOUT_VERSION = 1
+
+# Answers with none of these (inline markup, HTML/entities, block markers at the start
+# of a line, indentation or hard breaks) come out of markdown2 unchanged apart from
+# paragraph spacing, so they skip the conversion
+MARKDOWN_SYNTAX = re.compile(r"[\\`*_\[\]<&\t\r]|^[ #>=+\-]|^\d+[.)]| $", re.MULTILINE)
+BLANK_LINES = re.compile(r"\n{2,}")
+HTML_TAG = re.compile('<.*?>')
+STRIP_MARKDOWN_CACHE_SIZE = 4096
+
+_executor = None
+
+@lru_cache(maxsize=STRIP_MARKDOWN_CACHE_SIZE)
 def strip_markdown(text):
     """Convert markdown to plain text"""
     if not text:
         return ""
+    if not MARKDOWN_SYNTAX.search(text):
+        # Plain text: markdown2 would only wrap each paragraph in <p>
+        return BLANK_LINES.sub("\n\n", text.strip())
     # Convert markdown to HTML then strip HTML tags
     html = markdown2.markdown(text)
     # Remove HTML tags
-    clean = re.sub('<.*?>', '', html)
+    clean = HTML_TAG.sub('', html)
     # Decode HTML entities
     clean = clean.replace('&lt;', '<').replace('&gt;', '>').replace('&amp;', '&')
     clean = clean.replace('&nbsp;', ' ').replace('&quot;', '"')
     return clean.strip()
 
+
+class GradescopeRenderer:
+    """
+    Builds Gradescope PDFs. Paragraph and table styles are created once per process
+    and shared by every document, instead of per call and per page.
+    """
+
+    # Estimated answer characters per page (~55 lines of text); both pages have the
+    # same space (no grading boxes)
+    CHARS_PER_PAGE = 3500
+
+    def __init__(self):
+        styles = getSampleStyleSheet()
+
+        self.header_style = ParagraphStyle(
+            'CustomHeader',
+            parent=styles['Normal'],
+            fontSize=9,
+            textColor=colors.HexColor('#34495e'),
+            spaceAfter=8,
+            alignment=TA_LEFT
+        )
+
+        self.link_style = ParagraphStyle(
+            'LinkStyle',
+            parent=styles['Normal'],
+            fontSize=8,
+            textColor=colors.HexColor('#3498db'),
+            spaceAfter=8,
+            alignment=TA_LEFT,
+            fontName='Courier'
+        )
+
+        self.answer_style = ParagraphStyle(
+            'AnswerStyle',
+            parent=styles['Normal'],
+            fontSize=10,
+            textColor=colors.HexColor('#2c3e50'),
+            spaceAfter=10,
+            leading=14,
+            leftIndent=5
+        )
+
+        self.no_answer_style = ParagraphStyle(
+            'NoAnswerStyle',
+            parent=styles['Italic'],
+            fontSize=10,
+            textColor=colors.HexColor('#999999'),
+            alignment=TA_LEFT,
+            spaceAfter=10,
+            leftIndent=5
+        )
+
+        self.answer_header_style = ParagraphStyle(
+            'AnswerHeader',
+            parent=styles['Normal'],
+            fontSize=10,
+            textColor=colors.HexColor('#34495e'),
+            fontName='Helvetica-Bold',
+            spaceAfter=8
+        )
+
+        self.header_table_style = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#f8f9fa')),
+            ('BOX', (0, 0), (-1, -1), 1, colors.HexColor('#e0e0e0')),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('TOPPADDING', (0, 0), (-1, -1), 6),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+            ('LEFTPADDING', (0, 0), (-1, -1), 8),
+        ])
+
+    def render(self, assignment_title, students_data, base_url="http://localhost:3000"):
+        """Build the PDF for students_data (see create_gradescope_pdf); returns a BytesIO"""
+        buffer = BytesIO()
+        doc = SimpleDocTemplate(
+            buffer,
+            pagesize=letter,
+            rightMargin=0.5*inch,
+            leftMargin=0.5*inch,
+            topMargin=0.5*inch,
+            bottomMargin=0.5*inch
+        )
+
+        story = []
+        for student in students_data:
+            for question in student["questions"]:
+                self.add_question_pages(story, assignment_title, student, question, base_url)
+
+        doc.build(story)
+        buffer.seek(0)
+        return buffer
+
+    def add_question_pages(self, story, assignment_title, student, question, base_url):
+        """Append the 2 pages for one student's question"""
+        # ✅ Format submission time
+        submitted_at_str = "Not submitted"
+        if question.get('submitted_at'):
+            try:
+                # Parse ISO format datetime
+                dt = datetime.fromisoformat(question['submitted_at'].replace('Z', '+00:00'))
+                submitted_at_str = dt.strftime("%Y-%m-%d %H:%M:%S UTC")
+            except:
+                submitted_at_str = str(question['submitted_at'])
+
+        chat_link = f"{base_url}/?chat_id={question['chat_id']}" if question.get('chat_id') else None
+        # Clean markdown from answer once for both pages
+        answer_text = strip_markdown(question['student_solution']) if question.get('student_solution') else None
+
+        for page_num in range(2):
+            # Student info header (on every page)
+            header_data = [
+                [Paragraph(f"<b>Name:</b> {student['name']}", self.header_style)],
+                [Paragraph(f"<b>Email:</b> {student['email']}", self.header_style)],
+                [Paragraph(f"<b>Assignment:</b> {assignment_title}", self.header_style)],
+                [Paragraph(f"<b>Question {question['number']}</b> (Page {page_num + 1} of 2) - <b>{question['marks']} marks</b>", self.header_style)],
+                [Paragraph(f"<b>Submitted:</b> {submitted_at_str}", self.header_style)]  # ✅ Added submission time
+            ]
+
+            if chat_link:
+                header_data.append([Paragraph(f"<b>Chat Link:</b> {chat_link}", self.link_style)])
+
+            header_table = Table(header_data, colWidths=[7*inch])
+            header_table.setStyle(self.header_table_style)
+
+            story.append(header_table)
+            story.append(Spacer(1, 0.15*inch))
+
+            # Student's answer section
+            if answer_text is not None:
+                if page_num == 0:
+                    story.append(Paragraph("<b>Student Answer:</b>", self.answer_header_style))
+                    self.add_answer_paragraphs(story, self.first_page_chunk(answer_text))
+                elif len(answer_text) > self.CHARS_PER_PAGE:
+                    # Continuation of answer; page 2 stays empty if it fits on page 1
+                    story.append(Paragraph("<b>Student Answer (continued):</b>", self.answer_header_style))
+                    self.add_answer_paragraphs(story, answer_text[self.CHARS_PER_PAGE:])
+            elif page_num == 0:
+                # No answer submitted - only show on page 1, page 2 stays empty
+                story.append(Paragraph("<b>Student Answer:</b>", self.answer_header_style))
+                story.append(Paragraph("[No answer submitted]", self.no_answer_style))
+
+            # Page break after each page
+            story.append(PageBreak())
+
+    def first_page_chunk(self, answer_text):
+        """The part of an answer shown on its first page"""
+        if len(answer_text) <= self.CHARS_PER_PAGE:
+            return answer_text
+        # Long answer - try to break at sentence or paragraph
+        answer_chunk = answer_text[:self.CHARS_PER_PAGE]
+        last_break = max(
+            answer_chunk.rfind('\n\n'),
+            answer_chunk.rfind('. '),
+            answer_chunk.rfind('.\n')
+        )
+        if last_break > self.CHARS_PER_PAGE * 0.7:  # Only break if reasonable
+            answer_chunk = answer_chunk[:last_break + 1]
+        return answer_chunk
+
+    def add_answer_paragraphs(self, story, text):
+        for para in text.split('\n'):
+            if para.strip():
+                story.append(Paragraph(para.strip(), self.answer_style))
+
+
+gradescope_renderer = GradescopeRenderer()
+
+
 def create_gradescope_pdf(assignment_title, students_data, base_url="http://localhost:3000"):
     """
     Create a Gradescope-compatible PDF with 2 pages per question per student.
@@ -50,173 +253,145 @@ def create_gradescope_pdf(assignment_title, students_data, base_url="http://loca
     Returns:
         BytesIO buffer containing the PDF
     """
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(
-        buffer,
-        pagesize=letter,
-        rightMargin=0.5*inch,
-        leftMargin=0.5*inch,
-        topMargin=0.5*inch,
-        bottomMargin=0.5*inch
-    )
-    
-    # Define styles
-    styles = getSampleStyleSheet()
-    
-    header_style = ParagraphStyle(
-        'CustomHeader',
-        parent=styles['Normal'],
-        fontSize=9,
-        textColor=colors.HexColor('#34495e'),
-        spaceAfter=8,
-        alignment=TA_LEFT
-    )
-    
-    link_style = ParagraphStyle(
-        'LinkStyle',
-        parent=styles['Normal'],
-        fontSize=8,
-        textColor=colors.HexColor('#3498db'),
-        spaceAfter=8,
-        alignment=TA_LEFT,
-        fontName='Courier'
-    )
-    
-    answer_style = ParagraphStyle(
-        'AnswerStyle',
-        parent=styles['Normal'],
-        fontSize=10,
-        textColor=colors.HexColor('#2c3e50'),
-        spaceAfter=10,
-        leading=14,
-        leftIndent=5
-    )
-    
-    no_answer_style = ParagraphStyle(
-        'NoAnswerStyle',
-        parent=styles['Italic'],
-        fontSize=10,
-        textColor=colors.HexColor('#999999'),
-        alignment=TA_LEFT,
-        spaceAfter=10,
-        leftIndent=5
-    )
-    
-    answer_header_style = ParagraphStyle(
-        'AnswerHeader',
-        parent=styles['Normal'],
-        fontSize=10,
-        textColor=colors.HexColor('#34495e'),
-        fontName='Helvetica-Bold',
-        spaceAfter=8
+    return gradescope_renderer.render(assignment_title, students_data, base_url)
+
+
+def render_student_fragment(assignment_title, student, base_url, path):
+    """Write one student's pages to path as a standalone PDF (runs in a worker process)"""
+    with open(path, "wb") as f:
+        f.write(create_gradescope_pdf(assignment_title, [student], base_url).getbuffer())
+
+
+def merge_pdf_fragments(paths: list, output_path):
+    """Concatenate the PDF fragment files in order into output_path (runs in a worker process)"""
+    writer = PdfWriter()
+    for path in paths:
+        writer.append(PdfReader(path))
+    with open(output_path, "wb") as f:
+        writer.write(f)
+
+
+def fragment_key(assignment_title, student, base_url) -> str:
+    """Hash of everything that affects a student's pages"""
+    payload = json.dumps(
+        [FRAGMENT_LAYOUT_VERSION, assignment_title, base_url, student],
+        sort_keys=True,
+        default=str
     )
-    
-    story = []
-    
-    # Iterate through each student
-    for student_idx, student in enumerate(students_data):
-        # Iterate through each question
-        for q_idx, question in enumerate(student["questions"]):
-            # ✅ Format submission time
-            submitted_at_str = "Not submitted"
-            if question.get('submitted_at'):
-                try:
-                    # Parse ISO format datetime
-                    dt = datetime.fromisoformat(question['submitted_at'].replace('Z', '+00:00'))
-                    submitted_at_str = dt.strftime("%Y-%m-%d %H:%M:%S UTC")
-                except:
-                    submitted_at_str = str(question['submitted_at'])
-            
-            # Create 2 pages per question
-            for page_num in range(2):
-                # Student info header (on every page)
-                header_data = [
-                    [Paragraph(f"<b>Name:</b> {student['name']}", header_style)],
-                    [Paragraph(f"<b>Email:</b> {student['email']}", header_style)],
-                    [Paragraph(f"<b>Assignment:</b> {assignment_title}", header_style)],
-                    [Paragraph(f"<b>Question {question['number']}</b> (Page {page_num + 1} of 2) - <b>{question['marks']} marks</b>", header_style)],
-                    [Paragraph(f"<b>Submitted:</b> {submitted_at_str}", header_style)]  # ✅ Added submission time
-                ]
-                
-                if question.get('chat_id'):
-                    chat_link = f"{base_url}/?chat_id={question['chat_id']}"
-                    header_data.append([Paragraph(f"<b>Chat Link:</b> {chat_link}", link_style)])
-                
-                header_table = Table(header_data, colWidths=[7*inch])
-                header_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#f8f9fa')),
-                    ('BOX', (0, 0), (-1, -1), 1, colors.HexColor('#e0e0e0')),
-                    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                    ('TOPPADDING', (0, 0), (-1, -1), 6),
-                    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-                    ('LEFTPADDING', (0, 0), (-1, -1), 8),
-                ]))
-                
-                story.append(header_table)
-                story.append(Spacer(1, 0.15*inch))
-                
-                # Student's answer section
-                if question.get('student_solution'):
-                    # Clean markdown from answer
-                    answer_text = strip_markdown(question['student_solution'])
-                    
-                    # Estimate characters per page
-                    # Both pages have same available space now (no grading boxes)
-                    chars_per_page = 3500  # ~55 lines of text
-                    
-                    if page_num == 0:
-                        # First page
-                        story.append(Paragraph("<b>Student Answer:</b>", answer_header_style))
-                        
-                        if len(answer_text) <= chars_per_page:
-                            # Short answer - fits on page 1
-                            paragraphs = answer_text.split('\n')
-                            for para in paragraphs:
-                                if para.strip():
-                                    story.append(Paragraph(para.strip(), answer_style))
-                        else:
-                            # Long answer - split across pages
-                            answer_chunk = answer_text[:chars_per_page]
-                            # Try to break at sentence or paragraph
-                            last_break = max(
-                                answer_chunk.rfind('\n\n'),
-                                answer_chunk.rfind('. '),
-                                answer_chunk.rfind('.\n')
-                            )
-                            if last_break > chars_per_page * 0.7:  # Only break if reasonable
-                                answer_chunk = answer_chunk[:last_break + 1]
-                            
-                            paragraphs = answer_chunk.split('\n')
-                            for para in paragraphs:
-                                if para.strip():
-                                    story.append(Paragraph(para.strip(), answer_style))
-                    
-                    else:  # page_num == 1
-                        # Second page
-                        if len(answer_text) > chars_per_page:
-                            # Continuation of answer
-                            story.append(Paragraph("<b>Student Answer (continued):</b>", answer_header_style))
-                            
-                            # Get the remainder
-                            answer_chunk = answer_text[chars_per_page:]
-                            
-                            paragraphs = answer_chunk.split('\n')
-                            for para in paragraphs:
-                                if para.strip():
-                                    story.append(Paragraph(para.strip(), answer_style))
-                        # else: page 2 stays empty if answer fits on page 1
-                
-                else:
-                    # No answer submitted - only show on page 1
-                    if page_num == 0:
-                        story.append(Paragraph("<b>Student Answer:</b>", answer_header_style))
-                        story.append(Paragraph("[No answer submitted]", no_answer_style))
-                    # Page 2 stays empty
-                
-                # Page break after each page
-                story.append(PageBreak())
-    
-    # Build PDF
-    doc.build(story)
-    buffer.seek(0)
-    return buffer
\ No newline at end of file
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def get_pdf_executor() -> ProcessPoolExecutor:
+    """Process pool for ReportLab rendering (spawned, so workers do not inherit the event loop)"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=PDF_RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+def shutdown_pdf_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def store_fragments(cache, fragments: dict):
+    """Write rendered fragments to the cache; failures are logged, not raised"""
+    try:
+        await cache.put_many(fragments)
+    except Exception as e:
+        logger.warning(f"Failed to cache {len(fragments)} PDF fragment(s): {type(e).__name__}: {e}")
+
+
+async def render_pdf_to_file(assignment_title, students_data, base_url="http://localhost:3000",
+                             progress=None, cache=None):
+    """
+    Render the Gradescope PDF in the process pool without blocking the event loop.
+
+    Each student's pages are rendered as a separate fragment file, in parallel across
+    the pool, and the fragments are then merged in student order. With a cache (an
+    object with async iter_many(keys) yielding (key, bytes) and async
+    put_many({key: bytes})), fragments are looked up by fragment_key so only students
+    whose data changed are re-rendered.
+
+    Workers write fragments and the merged PDF to temporary files and only pass paths
+    back, so the PDF is never held in this process. progress is an optional async
+    callback progress(students_done, total_students). Returns the open temporary file
+    positioned at the start; closing it deletes it.
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_pdf_executor()
+    total = len(students_data)
+    keys = [fragment_key(assignment_title, student, base_url) for student in students_data]
+
+    with TemporaryDirectory(prefix="pdf_fragments_") as fragment_dir:
+        def fragment_path(key):
+            return os.path.join(fragment_dir, f"{key}.pdf")
+
+        # The cache is best-effort: on failure, render whatever was not fetched
+        cached = set()
+        if cache is not None:
+            try:
+                async for key, fragment in cache.iter_many(set(keys)):
+                    with open(fragment_path(key), "wb") as f:
+                        f.write(fragment)
+                    cached.add(key)
+            except Exception as e:
+                logger.warning(f"PDF fragment cache lookup failed: {type(e).__name__}: {e}")
+
+        # Identical students (same key) are rendered once
+        pending = {}
+        for key, student in zip(keys, students_data):
+            if key not in cached and key not in pending:
+                pending[key] = student
+        key_counts = Counter(keys)
+        students_per_key = {key: key_counts[key] for key in pending}
+
+        done = total - sum(students_per_key.values())
+        if progress is not None:
+            await progress(done, total)
+
+        async def render(key, student):
+            await loop.run_in_executor(
+                executor, render_student_fragment, assignment_title, student, base_url, fragment_path(key)
+            )
+            return key
+
+        to_cache = {}
+        for next_done in asyncio.as_completed([render(key, student) for key, student in pending.items()]):
+            key = await next_done
+            done += students_per_key[key]
+            if progress is not None:
+                await progress(done, total)
+            if cache is not None:
+                with open(fragment_path(key), "rb") as f:
+                    to_cache[key] = f.read()
+                if len(to_cache) >= CACHE_WRITE_BATCH:
+                    await store_fragments(cache, to_cache)
+                    to_cache = {}
+
+        if to_cache:
+            await store_fragments(cache, to_cache)
+
+        output = NamedTemporaryFile(prefix="export_", suffix=".pdf")
+        try:
+            await loop.run_in_executor(executor, merge_pdf_fragments, [fragment_path(key) for key in keys], output.name)
+        except BaseException:
+            output.close()
+            raise
+
+    output.seek(0)
+    return output
+
+
+def iter_file(file, chunk_size: int = FILE_CHUNK_SIZE):
+    """Yield a file in chunks and close it (for StreamingResponse)"""
+    try:
+        while chunk := file.read(chunk_size):
+            yield chunk
+    finally:
+        file.close()
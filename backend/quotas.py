@@ -0,0 +1,124 @@
+# quotas.py
+"""
+Daily LLM token budgets.
+
+Two budgets are enforced for chat completions, both reset at 00:00 UTC:
+- per user, across all chats: USER_DAILY_TOKEN_BUDGET
+- per student per assignment, for that assignment's chats: the assignment document's
+  "daily_token_budget" field, falling back to ASSIGNMENT_DAILY_TOKEN_BUDGET
+
+A budget of 0 (or None) means unlimited. Usage is charged from the completion's
+`usage.total_tokens` into day-bucketed documents in token_usage, which a TTL index
+removes after a couple of days. The buckets also accumulate prompt_tokens and the
+provider-cached share of them (cached_tokens) to track prompt-cache hit rates.
+"""
+from fastapi import HTTPException
+from datetime import datetime, timedelta, timezone
+import logging
+from backend.db_mongo import token_usage_collection
+from backend.db_assignments import assignments_collection
+from backend.config import USER_DAILY_TOKEN_BUDGET, ASSIGNMENT_DAILY_TOKEN_BUDGET
+from backend.llm_gateway import cached_prompt_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def usage_day(now: datetime | None = None) -> str:
+    return (now or datetime.now(timezone.utc)).strftime("%Y-%m-%d")
+
+
+def next_reset(now: datetime | None = None) -> datetime:
+    now = now or datetime.now(timezone.utc)
+    return (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def user_usage_id(user_id: str, day: str) -> str:
+    return f"user:{user_id}:{day}"
+
+
+def assignment_usage_id(user_id: str, assignment_id: str, day: str) -> str:
+    return f"assignment:{assignment_id}:{user_id}:{day}"
+
+
+async def get_assignment_budget(assignment_id: str | None) -> int:
+    if not assignment_id:
+        return 0
+    assignment = await assignments_collection.find_one(
+        {"assignment_id": assignment_id},
+        {"_id": 0, "daily_token_budget": 1}
+    )
+    budget = (assignment or {}).get("daily_token_budget")
+    return ASSIGNMENT_DAILY_TOKEN_BUDGET if budget is None else budget
+
+
+async def check_token_quota(user_id: str, assignment_id: str | None = None):
+    """Raise 429 if the user (or the user on this assignment) has used up today's budget"""
+    assignment_budget = await get_assignment_budget(assignment_id)
+    if not USER_DAILY_TOKEN_BUDGET and not assignment_budget:
+        return
+
+    day = usage_day()
+    ids = [user_usage_id(user_id, day)]
+    if assignment_budget:
+        ids.append(assignment_usage_id(user_id, assignment_id, day))
+
+    used = {
+        doc["_id"]: doc.get("tokens", 0)
+        async for doc in token_usage_collection.find({"_id": {"$in": ids}}, {"tokens": 1})
+    }
+
+    exceeded = None
+    if USER_DAILY_TOKEN_BUDGET and used.get(ids[0], 0) >= USER_DAILY_TOKEN_BUDGET:
+        exceeded = "Daily usage limit reached"
+    elif assignment_budget and used.get(ids[-1], 0) >= assignment_budget:
+        exceeded = "Daily usage limit for this assignment reached"
+
+    if exceeded:
+        reset_at = next_reset()
+        retry_after = max(1, int((reset_at - datetime.now(timezone.utc)).total_seconds()))
+        logger.warning(f"Token quota exceeded for {user_id} (assignment: {assignment_id})")
+        raise HTTPException(
+            status_code=429,
+            detail=f"{exceeded}. It resets at {reset_at.strftime('%H:%M')} UTC.",
+            headers={"Retry-After": str(retry_after), "X-Quota-Reset": reset_at.isoformat()}
+        )
+
+
+async def charge_tokens(user_id: str, assignment_id: str | None, usage) -> int:
+    """Add a completion's token usage to today's buckets; returns the tokens charged"""
+    tokens = getattr(usage, "total_tokens", None) or 0
+    if not tokens:
+        return 0
+
+    now = datetime.now(timezone.utc)
+    day = usage_day(now)
+    expires_at = next_reset(now) + timedelta(days=1)
+
+    buckets = [(user_usage_id(user_id, day), None)]
+    if assignment_id:
+        buckets.append((assignment_usage_id(user_id, assignment_id, day), assignment_id))
+
+    try:
+        for usage_id, bucket_assignment_id in buckets:
+            await token_usage_collection.update_one(
+                {"_id": usage_id},
+                {
+                    "$inc": {
+                        "tokens": tokens,
+                        "requests": 1,
+                        "prompt_tokens": getattr(usage, "prompt_tokens", None) or 0,
+                        "cached_tokens": cached_prompt_tokens(usage)
+                    },
+                    "$setOnInsert": {
+                        "user_id": user_id,
+                        "assignment_id": bucket_assignment_id,
+                        "day": day,
+                        "expires_at": expires_at
+                    }
+                },
+                upsert=True
+            )
+    except Exception as e:
+        # Never fail a completed turn because accounting failed
+        logger.error(f"Failed to record token usage for {user_id}: {e}")
+    return tokens
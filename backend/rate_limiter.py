@@ -1,50 +1,191 @@
 from fastapi import HTTPException, Request, Depends
-from collections import defaultdict
-from typing import Dict, List
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pymongo import ReturnDocument
+import logging
+import math
 import time
-from backend.auth import get_current_user
+from backend.auth import get_current_principal
+from backend.db_mongo import rate_limits_collection
+from backend.config import RATE_LIMIT_BACKEND, RATE_LIMIT_POLICIES
 
-rate_limit_storage: Dict[str, List[float]] = defaultdict(list)
+logger = logging.getLogger(__name__)
 
-def cleanup_old_requests(user_key: str, window_seconds: int = 60):
-    """Remove timestamps older than the window"""
-    current_time = time.time()
-    cutoff_time = current_time - window_seconds
-    rate_limit_storage[user_key] = [
-        timestamp for timestamp in rate_limit_storage[user_key] 
-        if timestamp > cutoff_time
-    ]
+
+class SlidingWindowCounter:
+    """
+    Two-bucket sliding-window rate limiter with constant memory per key.
+
+    Each key keeps only the request count for the current fixed window and the one
+    before it; the request rate over the last `window_seconds` is estimated by
+    weighting the previous bucket by how much of it still overlaps the sliding window.
+    The key table is bounded: keys idle for two full windows are evicted as new keys
+    arrive, and the least recently used key is dropped once max_keys is reached.
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        # key -> [window_start, current_count, previous_count, window_seconds]
+        self._entries: OrderedDict[str, list] = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _roll(self, entry: list, now: float):
+        window_seconds = entry[3]
+        elapsed_windows = int((now - entry[0]) // window_seconds)
+        if elapsed_windows >= 2:
+            entry[1], entry[2] = 0, 0
+        elif elapsed_windows == 1:
+            entry[1], entry[2] = 0, entry[1]
+        if elapsed_windows > 0:
+            entry[0] += elapsed_windows * window_seconds
+
+    def _evict(self, now: float):
+        # Idle keys sit at the front of the LRU order
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if now - oldest[0] < 2 * oldest[3]:
+                break
+            self._entries.popitem(last=False)
+        while len(self._entries) >= self.max_keys:
+            self._entries.popitem(last=False)
+
+    def _entry(self, key: str, window_seconds: int, now: float) -> list:
+        entry = self._entries.get(key)
+        if entry is None or entry[3] != window_seconds:
+            if entry is None:
+                self._evict(now)
+            entry = [now, 0, 0, window_seconds]
+            self._entries[key] = entry
+        else:
+            self._roll(entry, now)
+        self._entries.move_to_end(key)
+        return entry
+
+    def count(self, key: str, window_seconds: int = 60, now: float | None = None) -> float:
+        """Estimated number of requests for key in the last window_seconds"""
+        now = time.time() if now is None else now
+        entry = self._entry(key, window_seconds, now)
+        overlap = 1 - (now - entry[0]) / window_seconds
+        return entry[2] * overlap + entry[1]
+
+    def record(self, key: str, window_seconds: int = 60, now: float | None = None):
+        now = time.time() if now is None else now
+        self._entry(key, window_seconds, now)[1] += 1
+
+    def retry_after(self, key: str, window_seconds: int = 60, now: float | None = None) -> int:
+        """Seconds until the current fixed window rolls over"""
+        now = time.time() if now is None else now
+        entry = self._entry(key, window_seconds, now)
+        return max(1, math.ceil(entry[0] + window_seconds - now))
+
+    def clear(self):
+        self._entries.clear()
+
+
+class InMemoryRateLimitStore:
+    """Per-process limiter state (default). Limits are per worker and reset on restart."""
+
+    def __init__(self, counter: SlidingWindowCounter):
+        self.counter = counter
+
+    async def hit(self, key: str, limit: int, window_seconds: int) -> tuple[bool, int]:
+        """Count one request for key; returns (allowed, retry_after_seconds)"""
+        if self.counter.count(key, window_seconds) >= limit:
+            return False, self.counter.retry_after(key, window_seconds)
+        self.counter.record(key, window_seconds)
+        return True, 0
+
+
+class MongoRateLimitStore:
+    """
+    Shared limiter state so limits hold across uvicorn workers and deploys.
+
+    Uses the same two-bucket sliding window as SlidingWindowCounter, with one document
+    per (key, window-aligned bucket) incremented atomically with $inc. Buckets carry an
+    expires_at that the TTL index on rate_limits uses to delete them.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    @staticmethod
+    def bucket_id(key: str, window_seconds: int, bucket_start: int) -> str:
+        return f"{key}:{window_seconds}:{bucket_start}"
+
+    async def hit(self, key: str, limit: int, window_seconds: int) -> tuple[bool, int]:
+        now = time.time()
+        bucket_start = int(now // window_seconds) * window_seconds
+        current_id = self.bucket_id(key, window_seconds, bucket_start)
+
+        current = await self.collection.find_one_and_update(
+            {"_id": current_id},
+            {
+                "$inc": {"count": 1},
+                "$setOnInsert": {
+                    "key": key,
+                    "expires_at": datetime.fromtimestamp(bucket_start + 2 * window_seconds, tz=timezone.utc)
+                }
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        previous = await self.collection.find_one(
+            {"_id": self.bucket_id(key, window_seconds, bucket_start - window_seconds)},
+            {"count": 1}
+        )
+
+        overlap = 1 - (now - bucket_start) / window_seconds
+        estimate = (previous or {}).get("count", 0) * overlap + current["count"]
+        if estimate > limit:
+            # Rejected requests do not consume budget
+            await self.collection.update_one({"_id": current_id}, {"$inc": {"count": -1}})
+            return False, max(1, math.ceil(bucket_start + window_seconds - now))
+        return True, 0
+
+
+rate_limit_storage = SlidingWindowCounter()
+
+def get_rate_limit_store():
+    if RATE_LIMIT_BACKEND == "mongo":
+        return MongoRateLimitStore(rate_limits_collection)
+    return InMemoryRateLimitStore(rate_limit_storage)
+
+rate_limit_store = get_rate_limit_store()
 
 def check_rate_limit(user_key: str, max_requests: int, window_seconds: int = 60) -> bool:
-    """Check if user has exceeded rate limit"""
-    cleanup_old_requests(user_key, window_seconds)
-    current_requests = len(rate_limit_storage[user_key])
-    return current_requests < max_requests
-
-def record_request(user_key: str):
-    """Record a new request timestamp"""
-    rate_limit_storage[user_key].append(time.time())
-
-async def rate_limit_dependency(request: Request, user: dict = Depends(get_current_user)):
-    """Dependency to enforce rate limits on endpoints"""
-    auth0_id = user["auth0_id"]
-    user_key = auth0_id
-    
-    path = request.url.path
-    
-    if path == "/chat/start":
-        if not check_rate_limit(f"start:{user_key}", 5):
-            raise HTTPException(
-                status_code=429, 
-                detail="Rate limit exceeded for starting new chats. Try again in a minute.",
-                headers={"Retry-After": "60"}
-            )
-    elif path == "/chat":
-        if not check_rate_limit(f"chat:{user_key}", 20):
-            raise HTTPException(
-                status_code=429, 
-                detail="Rate limit exceeded for chat messages. Try again in a minute.",
-                headers={"Retry-After": "60"}
-            )
+    """Check if user has exceeded rate limit (in-process counter)"""
+    return rate_limit_storage.count(user_key, window_seconds) < max_requests
+
+def record_request(user_key: str, window_seconds: int = 60):
+    """Record a new request (in-process counter)"""
+    rate_limit_storage.record(user_key, window_seconds)
+
+async def rate_limit_dependency(request: Request, user: dict = Depends(get_current_principal)):
+    """
+    Dependency to enforce rate limits on endpoints.
+
+    The policy for a route is looked up in RATE_LIMIT_POLICIES by its path template;
+    routes without a policy are not limited. Routes sharing a scope share a budget.
+    """
+    user_key = user["auth0_id"]
+
+    route = request.scope.get("route")
+    path = getattr(route, "path", request.url.path)
+    policy = RATE_LIMIT_POLICIES.get(path)
+    if not policy:
+        return user_key
+
+    allowed, retry_after = await rate_limit_store.hit(
+        f"{policy['scope']}:{user_key}", policy["limit"], policy.get("window", 60)
+    )
+    if not allowed:
+        logger.warning(f"Rate limit exceeded for {policy['scope']}:{user_key}")
+        raise HTTPException(
+            status_code=429,
+            detail=policy.get("detail", "Rate limit exceeded. Try again later."),
+            headers={"Retry-After": str(retry_after)}
+        )
     
-    return user_key
\ No newline at end of file
+    return user_key
@@ -1,8 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException
 from datetime import datetime, timezone
 from backend.admin import require_admin
-from backend.auth import get_current_user, http_bearer
-from fastapi.security import HTTPAuthorizationCredentials
+from backend.auth import invalidate_user_profile, verified_token_cache
+from backend.admission import admission_controller
+from backend import llm_gateway
+from backend.pdf_fragment_cache import pdf_fragment_cache
 from backend.models import AddAdminRequest, RemoveAdminRequest, AddGraderRequest, RemoveGraderRequest
 from backend.db_mongo import users_collection
 
@@ -17,6 +19,16 @@ async def check_admin_status(user: dict = Depends(require_admin)):
         "email": user["email"]
     }
 
+@router.get("/metrics")
+async def get_metrics(user: dict = Depends(require_admin)):
+    """Per-worker runtime metrics: LLM admission queue, LLM gateway (circuits, latency, hedging), auth and PDF fragment caches (admin only)"""
+    return {
+        "llm_admission": admission_controller.stats(),
+        "llm_gateway": llm_gateway.stats(),
+        "token_cache": verified_token_cache.stats(),
+        "pdf_fragment_cache": pdf_fragment_cache.stats() if pdf_fragment_cache else None
+    }
+
 @router.get("/list")
 async def list_admins(user: dict = Depends(require_admin)):
     """List all admins"""
@@ -64,6 +76,7 @@ async def add_admin(request: AddAdminRequest, user: dict = Depends(require_admin
             }
         }
     )
+    invalidate_user_profile(user_doc.get("auth0_id"))
     
     return {
         "message": f"Successfully added {email} as admin",
@@ -102,6 +115,7 @@ async def remove_admin(request: RemoveAdminRequest, user: dict = Depends(require
             }
         }
     )
+    invalidate_user_profile(user_doc.get("auth0_id"))
     
     return {
         "message": f"Successfully removed admin privileges from {email}",
@@ -157,6 +171,7 @@ async def add_grader(request: AddGraderRequest, user: dict = Depends(require_adm
             }
         }
     )
+    invalidate_user_profile(user_doc.get("auth0_id"))
     
     return {
         "message": f"Successfully added {email} as grader",
@@ -195,6 +210,7 @@ async def remove_grader(request: RemoveGraderRequest, user: dict = Depends(requi
             }
         }
     )
+    invalidate_user_profile(user_doc.get("auth0_id"))
     
     return {
         "message": f"Successfully removed grader privileges from {email}",
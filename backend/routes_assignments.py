@@ -1,6 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException
-from backend.auth import get_current_user, http_bearer
-from fastapi.security import HTTPAuthorizationCredentials
+from backend.auth import get_current_principal
 from backend.admin import require_admin
 from backend.models_assignments import (
     CreateTemplateRequest, 
@@ -21,22 +20,44 @@ from backend.db_assignments import (
     quiz_templates_collection,
     student_quiz_responses_collection
 )
-from backend.db_mongo import conversations_collection, users_collection
+from backend.db_mongo import conversations_collection
+from backend.message_store import create_conversation, get_messages
+from backend.context_builder import QUESTION_CONTEXT_HEADER
 from datetime import datetime, timezone
 import uuid
 from fastapi.responses import StreamingResponse
-from backend.pdf_generator import create_gradescope_pdf
+from backend.pdf_generator import render_pdf_to_file, iter_file
+from backend.export_jobs import load_assignment_export, pdf_filename
+from backend.pdf_fragment_cache import pdf_fragment_cache
+from backend.config import FRONTEND_URL
 from typing import Optional, List
 
 router = APIRouter()
 
 # ========== HELPER FUNCTION ==========
 
+ASSIGNMENT_SYSTEM_PROMPT = (
+    "You are ALAASKA, a supportive teaching assistant. Your job is to guide the user to think critically and find the solution on their own. "
+    "If a student says he lacks foundational or conceptual knowledge, you may provide clear explanations, definitions, or analogies to build their base understanding. "
+    "Never reveal full or partial solutions to the actual assignment question. If the student says they don't understand, ask them to explain their reasoning first, then build from it. "
+    "Break problems into small steps. After each step, ask what they think comes next. Confirm correctness only, no explanations. "
+    "If wrong, give a counterexample or simpler question, not the fix. Always end replies with a guiding question. "
+    "Have the student summarize once enough progress is made and ask them to use the 'Mark as Final Answer' button to submit. "
+    "Acknowledge that you are an AI; if a student reasonably argues that your complex calculation is incorrect, graciously re-evaluate their reasoning rather than stubbornly insisting on your output."
+    "Assess their level through guiding questions, and use flashcards, mini quizzes, or scenarios when suitable."
+    "Discuss only academic topics."
+)
+
 def create_assignment_system_prompt(question_number: str, question_text: str, hints: list = None) -> list:
     """
     Create initial messages for an assignment question chat.
     
-    Returns list of [system_message, assistant_greeting]
+    Returns list of [system_message, question_context, assistant_greeting]. The system
+    message is byte-identical for every question and student and everything
+    question-specific comes after it. At ~250 tokens it is below the provider's
+    1024-token prompt-caching minimum, so on its own it gives no cross-chat cache hits;
+    caching applies once a chat's stable prefix (system, question, earlier turns) is
+    long enough.
     """
     hints_text = ""
     if hints and len(hints) > 0:
@@ -45,18 +66,11 @@ def create_assignment_system_prompt(question_number: str, question_text: str, hi
     return [
         {
             "role": "system",
-            "content": (
-                "You are ALAASKA, a supportive teaching assistant. Your job is to guide the user to think critically and find the solution on their own. "
-                "If a student says he lacks foundational or conceptual knowledge, you may provide clear explanations, definitions, or analogies to build their base understanding. "
-                "Never reveal full or partial solutions to the actual assignment question. If the student says they don't understand, ask them to explain their reasoning first, then build from it. "
-                "Break problems into small steps. After each step, ask what they think comes next. Confirm correctness only, no explanations. "
-                "If wrong, give a counterexample or simpler question, not the fix. Always end replies with a guiding question. "
-                "Have the student summarize once enough progress is made and ask them to use the 'Mark as Final Answer' button to submit. "
-                "Acknowledge that you are an AI; if a student reasonably argues that your complex calculation is incorrect, graciously re-evaluate their reasoning rather than stubbornly insisting on your output."
-                "Assess their level through guiding questions, and use flashcards, mini quizzes, or scenarios when suitable."
-                "Discuss only academic topics."
-                f"\n\nThe student needs to solve this assignment question:\n\nQuestion {question_number}: {question_text}{hints_text}"
-            )
+            "content": ASSIGNMENT_SYSTEM_PROMPT
+        },
+        {
+            "role": "system",
+            "content": f"{QUESTION_CONTEXT_HEADER}Question {question_number}: {question_text}{hints_text}"
         },
         {
             "role": "assistant",
@@ -171,6 +185,7 @@ async def create_assignment(
         "allowed_students": [email.lower() for email in request.allowed_students],
         "pre_quiz_id": request.pre_quiz_id,  
         "post_quiz_id": request.post_quiz_id,
+        "daily_token_budget": request.daily_token_budget,
         "submissions_enabled": True, 
         "submission_exceptions": [], 
         "created_by": user["email"],
@@ -285,67 +300,29 @@ async def export_assignment_pdf(
     assignment_id: str,
     user: dict = Depends(require_admin)
 ):
-    """Export assignment submissions as Gradescope-compatible PDF (admin only)"""
+    """
+    Export assignment submissions as Gradescope-compatible PDF (admin only)
+
+    Rendered within the request; large classes should use
+    POST /assignments/{assignment_id}/export-jobs instead.
+    """
     try:
-        # Get assignment details
-        assignment = await assignments_collection.find_one({"assignment_id": assignment_id})
-        if not assignment:
-            raise HTTPException(status_code=404, detail="Assignment not found")
+        assignment, students_data = await load_assignment_export(assignment_id)
         
-        # Get all student submissions
-        cursor = student_assignments_collection.find(
-            {"assignment_id": assignment_id},
-            {"_id": 0}
-        )
-        
-        students_data = []
-        async for student_assignment in cursor:
-            # Get student details
-            user_doc = await users_collection.find_one({"email": student_assignment["student_email"]})
-            
-            student_name = user_doc.get("username", "Unknown") if user_doc else "Unknown"
-            student_email = student_assignment["student_email"]
-            
-            # ✅ Process questions with submission time
-            questions_data = []
-            for question in student_assignment["questions"]:
-                questions_data.append({
-                    "number": question.get("number", "?"),
-                    "marks": question.get("marks", 0),
-                    "student_solution": question.get("student_solution"),
-                    "chat_id": question.get("chat_id"),
-                    "submitted_at": question.get("submitted_at")  # ✅ Include submission time
-                })
-            
-            students_data.append({
-                "name": student_name,
-                "email": student_email,
-                "questions": questions_data
-            })
-        
-        if not students_data:
-            raise HTTPException(status_code=404, detail="No submissions found for this assignment")
-        
-        from backend.config import FRONTEND_URL
-        base_url = FRONTEND_URL if hasattr(FRONTEND_URL, '__str__') else "http://localhost:3000"
-        
-        # Generate PDF with base_url
-        pdf_buffer = create_gradescope_pdf(
+        # Generate PDF (rendered in worker processes into a temp file)
+        pdf_file = await render_pdf_to_file(
             assignment_title=assignment["title"],
             students_data=students_data,
-            base_url=base_url
+            base_url=FRONTEND_URL,
+            cache=pdf_fragment_cache
         )
         
-        # Create filename
-        safe_title = "".join(c if c.isalnum() or c in (' ', '-', '_') else '_' for c in assignment["title"])
-        filename = f"{safe_title}_submissions.pdf"
-        
         # Return as streaming response
         return StreamingResponse(
-            pdf_buffer,
+            iter_file(pdf_file),
             media_type="application/pdf",
             headers={
-                "Content-Disposition": f"attachment; filename={filename}"
+                "Content-Disposition": f"attachment; filename={pdf_filename(assignment['title'])}"
             }
         )
         
@@ -356,58 +333,81 @@ async def export_assignment_pdf(
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to generate PDF: {str(e)}")
+
+
+# Fields the student dashboard needs; question arrays are reduced to counts server-side
+DASHBOARD_ASSIGNMENT_PROJECTION = {
+    "_id": 0,
+    "assignment_id": 1,
+    "title": 1,
+    "description": 1,
+    "pre_quiz_id": 1,
+    "post_quiz_id": 1,
+    "submissions_enabled": 1,
+    "submission_exceptions": 1,
+    "total_questions": {"$size": {"$ifNull": ["$questions", []]}}
+}
+
+DASHBOARD_RECORD_PROJECTION = {
+    "_id": 0,
+    "assignment_id": 1,
+    "accepted_at": 1,
+    "submitted": 1,
+    "submitted_at": 1,
+    "post_quiz_completed": 1,
+    "questions_answered": {
+        "$size": {
+            "$filter": {
+                "input": {"$ifNull": ["$questions", []]},
+                "as": "q",
+                "cond": {"$ne": [{"$ifNull": ["$$q.student_solution", None]}, None]}
+            }
+        }
+    }
+}
+
 @router.get("/assignments")
-async def get_student_assignments(auth: HTTPAuthorizationCredentials = Depends(http_bearer)):
-    """Get all assignments for the current student"""
-    user = await get_current_user(auth)
+async def get_student_assignments(user: dict = Depends(get_current_principal)):
+    """Get all assignments for the current student (two queries regardless of how many)"""
     user_email = user["email"].lower()
     
     # Find assignments where this student is allowed
-    cursor = assignments_collection.find(
+    assignments = await assignments_collection.find(
         {"allowed_students": user_email},
-        {"_id": 0}
+        DASHBOARD_ASSIGNMENT_PROJECTION
+    ).to_list(length=None)
+
+    # Fetch the student's records for all of them at once
+    records_cursor = student_assignments_collection.find(
+        {
+            "student_email": user_email,
+            "assignment_id": {"$in": [a["assignment_id"] for a in assignments]}
+        },
+        DASHBOARD_RECORD_PROJECTION
     )
+    records = {record["assignment_id"]: record async for record in records_cursor}
     
     student_assignments = []
-    async for assignment in cursor:
-        # Check if student has accepted this assignment
-        student_record = await student_assignments_collection.find_one({
-            "assignment_id": assignment["assignment_id"],
-            "student_email": user_email
-        })
-        
-    
-        questions_answered = 0
-        submitted = False
-        submitted_at = None
-        post_quiz_completed = False
+    for assignment in assignments:
+        student_record = records.get(assignment["assignment_id"])
 
         submissions_enabled = assignment.get("submissions_enabled", True)
         submission_exceptions = [e.lower() for e in assignment.get("submission_exceptions", [])]
         can_submit = submissions_enabled or (user_email in submission_exceptions)
         
-        if student_record:
-            questions_answered = sum(
-                1 for q in student_record.get("questions", [])
-                if q.get("student_solution") is not None
-            )
-            submitted = student_record.get("submitted", False)
-            submitted_at = student_record.get("submitted_at")
-            post_quiz_completed = student_record.get("post_quiz_completed", False)
-        
         student_assignments.append({
             "assignment_id": assignment["assignment_id"],
             "title": assignment["title"],
             "description": assignment["description"],
-            "total_questions": len(assignment["questions"]),
+            "total_questions": assignment["total_questions"],
             "accepted": student_record is not None,
             "accepted_at": student_record["accepted_at"].isoformat() if student_record else None,
             "has_pre_quiz": assignment.get("pre_quiz_id") is not None,
             "has_post_quiz": assignment.get("post_quiz_id") is not None,
-            "post_quiz_completed": post_quiz_completed,
-            "questions_answered": questions_answered,
-            "submitted": submitted,  
-            "submitted_at": submitted_at,
+            "post_quiz_completed": student_record.get("post_quiz_completed", False) if student_record else False,
+            "questions_answered": student_record["questions_answered"] if student_record else 0,
+            "submitted": student_record.get("submitted", False) if student_record else False,
+            "submitted_at": student_record.get("submitted_at") if student_record else None,
             "submissions_enabled": can_submit
         })
     
@@ -415,9 +415,8 @@ async def get_student_assignments(auth: HTTPAuthorizationCredentials = Depends(h
 
 
 @router.post("/assignments/{assignment_id}/accept")
-async def accept_assignment(assignment_id: str, auth: HTTPAuthorizationCredentials = Depends(http_bearer)):
+async def accept_assignment(assignment_id: str, user: dict = Depends(get_current_principal)):
     """Accept an assignment - requires pre-quiz completion if exists"""
-    user = await get_current_user(auth)
     user_email = user["email"].lower()
     user_id = user["auth0_id"]
     
@@ -470,17 +469,17 @@ async def accept_assignment(assignment_id: str, auth: HTTPAuthorizationCredentia
         conversation_doc = {
             "chat_id": chat_id,
             "user_id": user_id,
-            "messages": initial_messages,
             "summary": f"{assignment['title']} - Q{question_number}",
             "created_at": datetime.now(timezone.utc),
             "updated_at": datetime.now(timezone.utc),
             "is_deleted": False,
             "assignment_id": assignment_id,
             "question_id": q["question_id"],
-            "is_assignment_chat": True
+            "is_assignment_chat": True,
+            "version": 0
         }
         
-        await conversations_collection.insert_one(conversation_doc)
+        await create_conversation(conversation_doc, initial_messages)
         
         questions_with_chats.append({
             "question_id": q["question_id"],
@@ -516,9 +515,8 @@ async def accept_assignment(assignment_id: str, auth: HTTPAuthorizationCredentia
 
 
 @router.get("/assignments/{assignment_id}")
-async def get_assignment_details(assignment_id: str, auth: HTTPAuthorizationCredentials = Depends(http_bearer)):
+async def get_assignment_details(assignment_id: str, user: dict = Depends(get_current_principal)):
     """Get assignment details with student's progress"""
-    user = await get_current_user(auth)
     user_email = user["email"].lower()
     
     # Get student's assignment record
@@ -572,10 +570,9 @@ async def get_question_chat(
     assignment_id: str,
     question_id: str,
     reset: bool = False,
-    auth: HTTPAuthorizationCredentials = Depends(http_bearer)
+    user: dict = Depends(get_current_principal)
 ):
     """Get or create chat for a specific question. If reset=True, archive old chat and create new one."""
-    user = await get_current_user(auth)
     user_email = user["email"].lower()
     user_id = user["auth0_id"]
     
@@ -669,17 +666,17 @@ async def get_question_chat(
     conversation_doc = {
         "chat_id": new_chat_id,
         "user_id": user_id,
-        "messages": initial_messages,
         "summary": f"{assignment_title} - Q{question_number}",
         "created_at": datetime.now(timezone.utc),
         "updated_at": datetime.now(timezone.utc),
         "is_deleted": False,
         "assignment_id": assignment_id,
         "question_id": question_id,
-        "is_assignment_chat": True
+        "is_assignment_chat": True,
+        "version": 0
     }
     
-    await conversations_collection.insert_one(conversation_doc)
+    await create_conversation(conversation_doc, initial_messages)
     
     # Update student assignment with new chat_id
     target_question["chat_id"] = new_chat_id
@@ -708,10 +705,9 @@ async def submit_answer(
     assignment_id: str,
     question_id: str,
     request: SubmitAnswerRequest,
-    auth: HTTPAuthorizationCredentials = Depends(http_bearer)
+    user: dict = Depends(get_current_principal)
 ):
     """Submit a message as the final answer for a question"""
-    user = await get_current_user(auth)
     user_email = user["email"].lower()
     
     # Get student assignment
@@ -753,7 +749,7 @@ async def submit_answer(
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
 
-    messages = chat.get("messages", [])
+    messages = await get_messages(chat)
     
     selected_message = None
     actual_index = -1
@@ -813,10 +809,9 @@ async def submit_answer(
 @router.post("/assignments/{assignment_id}/submit")
 async def submit_assignment(
     assignment_id: str,
-    auth: HTTPAuthorizationCredentials = Depends(http_bearer)
+    user: dict = Depends(get_current_principal)
 ):
     """Submit assignment - just marks it as submitted (requires post-quiz completion)"""
-    user = await get_current_user(auth)
     user_email = user["email"].lower()
     
     # Get student assignment
@@ -879,9 +874,8 @@ async def submit_assignment(
     }
 
 @router.get("/assignments/{assignment_id}/chats")
-async def get_assignment_chats(assignment_id: str, auth: HTTPAuthorizationCredentials = Depends(http_bearer)):
+async def get_assignment_chats(assignment_id: str, user: dict = Depends(get_current_principal)):
     """Get all chat sessions for this assignment"""
-    user = await get_current_user(auth)
     user_email = user["email"].lower()
     
     # Get student's assignment record
@@ -1113,10 +1107,9 @@ async def delete_quiz_template(
 @router.get("/assignments/{assignment_id}/pre-quiz")
 async def get_pre_quiz(
     assignment_id: str,
-    auth: HTTPAuthorizationCredentials = Depends(http_bearer)
+    user: dict = Depends(get_current_principal)
 ):
     """Get pre-quiz for an assignment"""
-    user = await get_current_user(auth)
     user_email = user["email"].lower()
     
     # Get assignment
@@ -1163,10 +1156,9 @@ async def get_pre_quiz(
 async def submit_pre_quiz(
     assignment_id: str,
     answers: List[SubmitQuizAnswerRequest],
-    auth: HTTPAuthorizationCredentials = Depends(http_bearer)
+    user: dict = Depends(get_current_principal)
 ):
     """Submit pre-quiz answers"""
-    user = await get_current_user(auth)
     user_email = user["email"].lower()
     
     # Get assignment
@@ -1244,10 +1236,9 @@ async def submit_pre_quiz(
 @router.get("/assignments/{assignment_id}/post-quiz")
 async def get_post_quiz(
     assignment_id: str,
-    auth: HTTPAuthorizationCredentials = Depends(http_bearer)
+    user: dict = Depends(get_current_principal)
 ):
     """Get post-quiz for an assignment"""
-    user = await get_current_user(auth)
     user_email = user["email"].lower()
     
     #  REMOVED: Check if student has completed all questions
@@ -1300,10 +1291,9 @@ async def get_post_quiz(
 async def submit_post_quiz(
     assignment_id: str,
     answers: List[SubmitQuizAnswerRequest],
-    auth: HTTPAuthorizationCredentials = Depends(http_bearer)
+    user: dict = Depends(get_current_principal)
 ):
     """Submit post-quiz answers"""
-    user = await get_current_user(auth)
     user_email = user["email"].lower()
     
     #  REMOVED: Same validation as get_post_quiz
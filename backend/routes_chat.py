@@ -1,20 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.security import HTTPAuthorizationCredentials
-from backend.auth import get_current_user, http_bearer
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from backend.auth import get_current_principal
+from backend.rate_limiter import rate_limit_dependency
+from backend.quotas import check_token_quota, charge_tokens
+from backend.admission import admission_controller, chat_priority
 from backend.models import ChatRequest
 from backend.db_mongo import conversations_collection
 from backend.db_assignments import student_assignments_collection
-from backend.config import OPENAI_API_KEY, MODEL_ID, SUMMARIZE_MODEL_ID
-from openai import AsyncOpenAI
+from backend.message_store import create_conversation, get_messages, get_message_window, append_messages
+from backend.context_builder import build_context
+from backend.utils import start_title_task, resolve_title, update_title_in_background
+from backend.config import MODEL_ID
+from backend import llm_gateway
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime, timezone
+import asyncio
+import json
 import uuid
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-
 SYSTEM_PROMPT = (
     "You are ALAASKA, a supportive teaching assistant. Your job is to guide the user to think critically and find the solution on their own."
     "Keep the conversation going with a question at the end your replies."
@@ -23,41 +30,68 @@ SYSTEM_PROMPT = (
     "Discuss only academic topics and nothing else."
 )
 
-async def summarize_title(text: str) -> str:
-    try:
-        resp = await client.chat.completions.create(
-            model=SUMMARIZE_MODEL_ID,
-            messages=[
-                {"role": "system", "content": "Give a 4-word title to this message"},
-                {"role": "user", "content": text}
-            ],
-            temperature=0.3
-        )
-        return (resp.choices[0].message.content or "").strip().strip('"')
-    except Exception as e:
-        logger.warning(f"Title summarization failed: {e}")
-        s = (text or "").strip()
-        return s if len(s) <= 50 else s[:50] + "..."
-
 def now_utc():
     return datetime.now(timezone.utc)
 
 
 # ========== GET ALL CONVERSATIONS ==========
 
+CONVERSATION_LIST_PROJECTION = {
+    "_id": 0,
+    "chat_id": 1,
+    "summary": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "is_assignment_chat": 1
+}
+
+def encode_conversation_cursor(conv: dict) -> str:
+    return f"{conv['updated_at'].isoformat()}|{conv['chat_id']}"
+
+def decode_conversation_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        updated_at, chat_id = cursor.rsplit("|", 1)
+        return datetime.fromisoformat(updated_at), chat_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @router.get("/conversations")
-async def get_conversations(auth: HTTPAuthorizationCredentials = Depends(http_bearer)):
-    """Get all conversations for the current user"""
-    user = await get_current_user(auth)
+async def get_conversations(
+    response: Response,
+    limit: int | None = Query(None, ge=1, le=200),
+    before: str | None = None,
+    user: dict = Depends(get_current_principal)
+):
+    """
+    Get conversations for the current user, most recently updated first.
+
+    Only the sidebar fields are read. Pass `limit` to page; when more conversations
+    remain, the X-Next-Cursor response header holds the value to send as `before`.
+    """
     user_id = user["auth0_id"]
-    
+
+    query = {"user_id": user_id, "is_deleted": False}
+    if before:
+        before_updated_at, before_chat_id = decode_conversation_cursor(before)
+        query["$or"] = [
+            {"updated_at": {"$lt": before_updated_at}},
+            {"updated_at": before_updated_at, "chat_id": {"$lt": before_chat_id}}
+        ]
+
     cursor = conversations_collection.find(
-        {"user_id": user_id, "is_deleted": False},
-        {"_id": 0}
-    ).sort("updated_at", -1)
-    
+        query,
+        CONVERSATION_LIST_PROJECTION
+    ).sort([("updated_at", -1), ("chat_id", -1)])
+    if limit:
+        cursor = cursor.limit(limit + 1)
+
+    docs = await cursor.to_list(None)
+    if limit and len(docs) > limit:
+        docs = docs[:limit]
+        response.headers["X-Next-Cursor"] = encode_conversation_cursor(docs[-1])
+
     conversations = []
-    async for conv in cursor:
+    for conv in docs:
         conversations.append({
             "chat_id": conv["chat_id"],
             "summary": conv.get("summary", "New Chat"),
@@ -74,10 +108,19 @@ async def get_conversations(auth: HTTPAuthorizationCredentials = Depends(http_be
 @router.get("/conversation/{chat_id}")
 async def get_conversation(
     chat_id: str,
-    auth: HTTPAuthorizationCredentials = Depends(http_bearer)
+    limit: int | None = Query(None, ge=1, le=500),
+    before_index: int | None = Query(None, ge=0),
+    since_index: int | None = Query(None, ge=0),
+    user: dict = Depends(get_current_principal)
 ):
-    """Get conversation messages with metadata"""
-    user = await get_current_user(auth)
+    """
+    Get conversation messages with metadata.
+
+    By default the full history is returned. Use `limit` (optionally with `before_index`)
+    to page backwards from the end, or `since_index` to fetch only messages the client
+    does not have yet. `start_index` is the absolute index of the first returned message
+    and `total_messages` the length of the full history.
+    """
     user_id = user["auth0_id"]
     user_email = user["email"].lower()
     is_grader = user.get("is_grader", False)  #  Changed from is_admin
@@ -87,13 +130,13 @@ async def get_conversation(
         conversation = await conversations_collection.find_one({
             "chat_id": chat_id,
             "is_deleted": False
-        })
+        }, {"messages": 0})
     else:
         conversation = await conversations_collection.find_one({
             "chat_id": chat_id,
             "user_id": user_id,
             "is_deleted": False
-        })
+        }, {"messages": 0})
 
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
@@ -144,19 +187,23 @@ async def get_conversation(
                     break
 
     # Return messages with metadata
-    messages = conversation.get("messages", [])
+    messages, start_index, total_messages = await get_message_window(
+        conversation, limit=limit, before_index=before_index, since_index=since_index
+    )
     
     return {
         "messages": messages,
+        "start_index": start_index,
+        "total_messages": total_messages,
+        "version": conversation.get("version", 0),
         "metadata": metadata
     }
 
 # ========== DELETE CONVERSATION ==========
 
 @router.put("/conversation/{chat_id}/delete")
-async def delete_conversation(chat_id: str, auth: HTTPAuthorizationCredentials = Depends(http_bearer)):
+async def delete_conversation(chat_id: str, user: dict = Depends(get_current_principal)):
     """Soft delete a conversation"""
-    user = await get_current_user(auth)
     user_id = user["auth0_id"]
     
     result = await conversations_collection.update_one(
@@ -172,9 +219,8 @@ async def delete_conversation(chat_id: str, auth: HTTPAuthorizationCredentials =
 
 # ========== START NEW CHAT ==========
 
-@router.post("/chat/start")
-async def start_chat(auth: HTTPAuthorizationCredentials = Depends(http_bearer)):
-    user = await get_current_user(auth)
+@router.post("/chat/start", dependencies=[Depends(rate_limit_dependency)])
+async def start_chat(user: dict = Depends(get_current_principal)):
     user_id = user["auth0_id"]
 
     chat_id = uuid.uuid4().hex
@@ -186,7 +232,6 @@ async def start_chat(auth: HTTPAuthorizationCredentials = Depends(http_bearer)):
     conversation_doc = {
         "chat_id": chat_id,
         "user_id": user_id,
-        "messages": initial_messages,
         "summary": "New Chat",
         "created_at": now_utc(),
         "updated_at": now_utc(),
@@ -194,9 +239,10 @@ async def start_chat(auth: HTTPAuthorizationCredentials = Depends(http_bearer)):
         "is_assignment_chat": False,
         "assignment_id": None,
         "question_id": None,
+        "version": 0,
     }
 
-    await conversations_collection.insert_one(conversation_doc)
+    await create_conversation(conversation_doc, initial_messages)
 
     return {
         "response": initial_messages[1]["content"],
@@ -207,17 +253,16 @@ async def start_chat(auth: HTTPAuthorizationCredentials = Depends(http_bearer)):
 
 # ========== SEND CHAT MESSAGE ==========
 
-@router.post("/chat")
-async def chat(request: ChatRequest, auth: HTTPAuthorizationCredentials = Depends(http_bearer)):
-    user = await get_current_user(auth)
-    user_id = user["auth0_id"]
-
-    msg_text = (request.message or "").strip()
+def validate_message_text(message: str) -> str:
+    msg_text = (message or "").strip()
     if not msg_text:
         raise HTTPException(status_code=400, detail="Message cannot be empty")
     if len(msg_text) > 3000:
         raise HTTPException(status_code=400, detail="Message exceeds maximum length of 3000 characters")
+    return msg_text
 
+async def load_chat_turn(request: ChatRequest, user_id: str, msg_text: str):
+    """Load (or start) the conversation for a new turn and append the user message"""
     chat_id = request.chat_id or uuid.uuid4().hex
     existing = None
 
@@ -229,51 +274,284 @@ async def chat(request: ChatRequest, auth: HTTPAuthorizationCredentials = Depend
         })
 
     if existing:
-        messages = existing.get("messages", [])
+        messages = await get_messages(existing)
         summary = existing.get("summary", "New Chat")
     else:
         messages = [{"role": "system", "content": SYSTEM_PROMPT}]
         summary = "New Chat"
 
     messages.append({"role": "user", "content": msg_text})
+    return chat_id, existing, messages, summary
+
+async def save_chat_turn(chat_id: str, user_id: str, existing: dict | None, messages: list, summary: str) -> int:
+    """
+    Persist a completed turn and return the new conversation version.
+
+    Existing conversations only get the user/assistant pair appended (see
+    message_store.append_messages); concurrent turns on the same chat return 409.
+    """
+    if existing:
+        return await append_messages(existing, messages[-2:], {})
+
+    conversation_doc = {
+        "chat_id": chat_id,
+        "user_id": user_id,
+        "summary": summary,
+        "created_at": now_utc(),
+        "updated_at": now_utc(),
+        "is_deleted": False,
+        "is_assignment_chat": False,
+        "assignment_id": None,
+        "question_id": None,
+        "version": 1
+    }
 
     try:
-        resp = await client.chat.completions.create(
-            model=MODEL_ID,
-            messages=messages,
-            temperature=0.7
+        await create_conversation(conversation_doc, messages)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=409,
+            detail="Conversation was updated by another request. Please refresh and try again."
         )
+    return 1
+
+@router.post("/chat", dependencies=[Depends(rate_limit_dependency)])
+async def chat(request: ChatRequest, user: dict = Depends(get_current_principal)):
+    user_id = user["auth0_id"]
+
+    msg_text = validate_message_text(request.message)
+    chat_id, existing, messages, summary = await load_chat_turn(request, user_id, msg_text)
+    assignment_id = existing.get("assignment_id") if existing else None
+    await check_token_quota(user_id, assignment_id)
+
+    # Title a new chat concurrently with the main completion instead of after it
+    title_task = start_title_task(msg_text) if not existing else None
+
+    try:
+        # Built before taking a slot: compaction may make its own (summarization) call
+        context = await build_context(existing, messages)
+        async with admission_controller.slot(user_id, chat_priority(existing)):
+            resp = await llm_gateway.complete_chat(
+                model=MODEL_ID,
+                messages=context,
+                temperature=0.7
+            )
         reply = resp.choices[0].message.content or ""
+        await charge_tokens(user_id, assignment_id, resp.usage)
+    except HTTPException:
+        if title_task:
+            title_task.cancel()
+        raise
     except Exception as e:
+        if title_task:
+            title_task.cancel()
         logger.error(f"OpenAI chat error: {e}")
         raise HTTPException(status_code=500, detail="LLM error")
 
     messages.append({"role": "assistant", "content": reply})
 
-    if not existing and summary in ("", "New Chat"):
-        summary = await summarize_title(msg_text)
+    if title_task:
+        summary = resolve_title(title_task, msg_text)
 
-    conversation_doc = {
-        "chat_id": chat_id,
-        "user_id": user_id,
-        "messages": messages,
-        "summary": summary,
-        "created_at": existing.get("created_at") if existing else now_utc(),
-        "updated_at": now_utc(),
-        "is_deleted": existing.get("is_deleted", False) if existing else False,
-        "is_assignment_chat": existing.get("is_assignment_chat", False) if existing else False,
-        "assignment_id": existing.get("assignment_id") if existing else None,
-        "question_id": existing.get("question_id") if existing else None
-    }
-
-    await conversations_collection.replace_one(
-        {"chat_id": chat_id, "user_id": user_id},
-        conversation_doc,
-        upsert=True
-    )
+    try:
+        version = await save_chat_turn(chat_id, user_id, existing, messages, summary)
+    except Exception:
+        if title_task:
+            title_task.cancel()
+        raise
+
+    if title_task:
+        update_title_in_background(chat_id, title_task, summary)
+
+    if request.delta:
+        start_index = len(messages) - 2 if existing else 0
+        return {
+            "response": reply,
+            "chat_id": chat_id,
+            "summary": summary,
+            "version": version,
+            "start_index": start_index,
+            "messages": [
+                {"index": start_index + offset, **msg}
+                for offset, msg in enumerate(messages[start_index:])
+            ]
+        }
 
     return {
         "response": reply,
         "chat_id": chat_id,
+        "summary": summary,
         "messages": messages
-    }
\ No newline at end of file
+    }
+
+
+# ========== STREAM CHAT MESSAGE (SSE) ==========
+
+def sse_event(data: dict, event: str | None = None) -> str:
+    """Format a Server-Sent Events frame"""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+class CleanupStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that awaits cleanup() when the response ends, even if the body
+    was never iterated (e.g. the client disconnected before the first chunk was sent)
+    """
+
+    def __init__(self, content, cleanup, **kwargs):
+        super().__init__(content, **kwargs)
+        self.cleanup = cleanup
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.cleanup()
+
+@router.post("/chat/stream", dependencies=[Depends(rate_limit_dependency)])
+async def chat_stream(
+    request: ChatRequest,
+    http_request: Request,
+    user: dict = Depends(get_current_principal)
+):
+    """
+    Same as POST /chat, but forwards model deltas as Server-Sent Events.
+
+    Events:
+        start  -> {"chat_id"}
+        (data) -> {"delta"} for each token chunk
+        done   -> {"chat_id", "response", "summary", "version", "message_index"} once saved
+        error  -> {"detail"} if the upstream call or saving the reply fails
+
+    If the client disconnects, the upstream completion is closed and nothing is saved.
+    """
+    user_id = user["auth0_id"]
+
+    msg_text = validate_message_text(request.message)
+    chat_id, existing, messages, summary = await load_chat_turn(request, user_id, msg_text)
+    assignment_id = existing.get("assignment_id") if existing else None
+    await check_token_quota(user_id, assignment_id)
+
+    title_task = start_title_task(msg_text) if not existing else None
+
+    # Built before taking a slot: compaction may make its own (summarization) call
+    try:
+        context = await build_context(existing, messages)
+    except Exception as e:
+        if title_task:
+            title_task.cancel()
+        logger.error(f"Failed to build chat stream context: {e}")
+        raise HTTPException(status_code=500, detail="LLM error")
+
+    # The admission slot is held until the stream finishes (released by finish_upstream)
+    try:
+        await admission_controller.acquire(user_id, chat_priority(existing))
+    except HTTPException:
+        if title_task:
+            title_task.cancel()
+        raise
+
+    try:
+        stream = await llm_gateway.complete_chat(
+            model=MODEL_ID,
+            messages=context,
+            temperature=0.7,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+    except HTTPException:
+        admission_controller.release()
+        if title_task:
+            title_task.cancel()
+        raise
+    except Exception as e:
+        admission_controller.release()
+        if title_task:
+            title_task.cancel()
+        logger.error(f"OpenAI chat stream error: {e}")
+        raise HTTPException(status_code=500, detail="LLM error")
+
+    upstream_open = True
+
+    async def finish_upstream(completed: bool):
+        """Release the admission slot and, unless the stream completed, close it (runs once)"""
+        nonlocal upstream_open
+        if not upstream_open:
+            return
+        upstream_open = False
+        admission_controller.release()
+        if not completed:
+            await stream.close()
+            if title_task:
+                title_task.cancel()
+
+    async def event_generator():
+        parts = []
+        completed = False
+        try:
+            yield sse_event({"chat_id": chat_id}, event="start")
+
+            async for chunk in stream:
+                if await http_request.is_disconnected():
+                    logger.info(f"Client disconnected from chat stream {chat_id}, cancelling upstream")
+                    return
+                if chunk.usage:
+                    llm_gateway.record_usage(MODEL_ID, chunk.usage)
+                    await charge_tokens(user_id, assignment_id, chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content or ""
+                if delta:
+                    parts.append(delta)
+                    yield sse_event({"delta": delta})
+
+            completed = True
+        except asyncio.CancelledError:
+            logger.info(f"Chat stream {chat_id} cancelled")
+            raise
+        except Exception as e:
+            logger.error(f"OpenAI chat stream error: {e}")
+            yield sse_event({"detail": "LLM error"}, event="error")
+            return
+        finally:
+            await finish_upstream(completed)
+
+        reply = "".join(parts)
+        messages.append({"role": "assistant", "content": reply})
+
+        title = resolve_title(title_task, msg_text) if title_task else summary
+
+        # Headers are already sent, so a failed save is reported as an error event
+        try:
+            version = await save_chat_turn(chat_id, user_id, existing, messages, title)
+        except Exception as e:
+            if title_task:
+                title_task.cancel()
+            if isinstance(e, HTTPException):
+                detail = e.detail
+            else:
+                logger.error(f"Failed to save chat stream {chat_id}: {e}")
+                detail = "Failed to save chat"
+            yield sse_event({"detail": detail}, event="error")
+            return
+
+        if title_task:
+            update_title_in_background(chat_id, title_task, title)
+
+        yield sse_event({
+            "chat_id": chat_id,
+            "response": reply,
+            "summary": title,
+            "version": version,
+            "message_index": len(messages) - 1
+        }, event="done")
+
+    return CleanupStreamingResponse(
+        event_generator(),
+        cleanup=lambda: finish_upstream(False),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
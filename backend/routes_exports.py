@@ -0,0 +1,66 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from backend.admin import require_admin
+from backend.db_mongo import export_jobs_collection
+from backend.db_assignments import assignments_collection
+from backend.export_jobs import PDF_EXPORT, CSV_EXPORTS, create_export_job, job_summary, open_artifact
+
+router = APIRouter()
+
+# ========== SUBMIT EXPORT JOBS ==========
+
+@router.post("/assignments/{assignment_id}/export-jobs")
+async def submit_assignment_pdf_export(assignment_id: str, user: dict = Depends(require_admin)):
+    """Queue a Gradescope PDF export of an assignment's submissions (admin only)"""
+    if not await assignments_collection.find_one({"assignment_id": assignment_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Assignment not found")
+
+    job = await create_export_job(PDF_EXPORT, {"assignment_id": assignment_id}, user["email"])
+    return job_summary(job)
+
+
+@router.post("/admin/export-jobs/{kind}")
+async def submit_data_export(kind: str, user: dict = Depends(require_admin)):
+    """Queue a CSV export of conversations, users or messages (admin only)"""
+    if kind not in CSV_EXPORTS:
+        raise HTTPException(status_code=400, detail=f"Unknown export kind. Use one of: {', '.join(CSV_EXPORTS)}")
+
+    job = await create_export_job(kind, {}, user["email"])
+    return job_summary(job)
+
+
+# ========== POLL AND DOWNLOAD ==========
+
+@router.get("/admin/export-jobs")
+async def list_export_jobs(limit: int = 50, user: dict = Depends(require_admin)):
+    """Most recent export jobs (admin only)"""
+    cursor = export_jobs_collection.find({}, {"_id": 0}).sort("created_at", -1).limit(min(max(limit, 1), 200))
+    return {"jobs": [job_summary(job) async for job in cursor]}
+
+
+@router.get("/export-jobs/{job_id}")
+async def get_export_job(job_id: str, user: dict = Depends(require_admin)):
+    """Status and progress of an export job (admin only)"""
+    job = await export_jobs_collection.find_one({"job_id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return job_summary(job)
+
+
+@router.get("/export-jobs/{job_id}/download")
+async def download_export(job_id: str, user: dict = Depends(require_admin)):
+    """Download a completed export (admin only)"""
+    job = await export_jobs_collection.find_one({"job_id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if job.get("status") != "completed":
+        raise HTTPException(status_code=409, detail=f"Export is {job.get('status')}, not completed")
+
+    return StreamingResponse(
+        open_artifact(job),
+        media_type=job["content_type"],
+        headers={
+            "Content-Disposition": f"attachment; filename={job['filename']}",
+            "Content-Length": str(job["size"])
+        }
+    )
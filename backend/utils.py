@@ -1,23 +1,76 @@
 from fastapi import HTTPException
-from openai import AsyncOpenAI
+import asyncio
+import logging
 import re
-from backend.config import OPENAI_API_KEY, SUMMARIZE_MODEL_ID
+from backend.config import SUMMARIZE_MODEL_ID
+from backend.db_mongo import conversations_collection
+from backend import llm_gateway
 
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+logger = logging.getLogger(__name__)
+
+# Strong references to fire-and-forget tasks so they are not garbage collected mid-flight
+_background_tasks: set = set()
 
 def validate_chat_id(chat_id: str):
     """Validate chat ID format"""
     if not re.match(r'^[a-f0-9]{8}$', chat_id):
         raise HTTPException(status_code=400, detail="Invalid chat ID format")
 
+def provisional_title(text: str) -> str:
+    """Title used until the generated one is available (also the fallback on failure)"""
+    s = (text or "").strip()
+    return s if len(s) <= 50 else s[:50] + "..."
+
 async def summarize_prompt(text: str) -> str:
     """Generate a short summary title for a message"""
-    response = await client.chat.completions.create(
-        model=SUMMARIZE_MODEL_ID,
-        messages=[
-            {"role": "system", "content": "Give a 4-word title to this message"},
-            {"role": "user", "content": text}
-        ],
-        temperature=0.3
-    )
-    return response.choices[0].message.content.strip().strip('"')
\ No newline at end of file
+    try:
+        response = await llm_gateway.create_completion(
+            deadline=15,
+            max_retries=1,
+            model=SUMMARIZE_MODEL_ID,
+            messages=[
+                {"role": "system", "content": "Give a 4-word title to this message"},
+                {"role": "user", "content": text}
+            ],
+            temperature=0.3
+        )
+        return (response.choices[0].message.content or "").strip().strip('"')
+    except Exception as e:
+        logger.warning(f"Title summarization failed: {e}")
+        return provisional_title(text)
+
+def start_title_task(text: str) -> asyncio.Task:
+    """Start generating a title concurrently with the main completion"""
+    return asyncio.create_task(summarize_prompt(text))
+
+def resolve_title(title_task: asyncio.Task, text: str) -> str:
+    """Title to store and respond with right now: the generated one if ready, else a provisional one"""
+    if title_task.done() and not title_task.cancelled():
+        return title_task.result()
+    return provisional_title(text)
+
+def update_title_in_background(chat_id: str, title_task: asyncio.Task, provisional: str):
+    """
+    Once the title task finishes, replace the provisional summary on the conversation.
+    The sidebar picks it up on its next /conversations fetch. Call after the conversation
+    has been saved with the provisional title.
+    """
+    if title_task.done():
+        return
+
+    async def finish():
+        try:
+            title = await title_task
+            if title and title != provisional:
+                await conversations_collection.update_one(
+                    {"chat_id": chat_id, "summary": provisional},
+                    {"$set": {"summary": title}}
+                )
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Failed to update title for chat {chat_id}: {e}")
+
+    task = asyncio.create_task(finish())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
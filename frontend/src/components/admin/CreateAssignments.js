@@ -129,9 +129,21 @@ export default function CreateAssignments({ templates, quizTemplates, assignment
       setBusy(true);
       showNotification('Generating PDF... This may take a moment', 'info');
       
-      const response = await api.post(
-        `/assignments/${assignmentId}/export-pdf`,
-        {},
+      // Large classes take longer than one request allows, so the export runs as a job
+      let job = (await api.post(`/assignments/${assignmentId}/export-jobs`)).data;
+      while (job.status === 'queued' || job.status === 'running') {
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+        job = (await api.get(`/export-jobs/${job.job_id}`)).data;
+        if (job.progress?.total) {
+          showNotification(`Generating PDF... ${job.progress.done}/${job.progress.total} students`, 'info');
+        }
+      }
+      if (job.status !== 'completed') {
+        throw new Error(job.error || 'Failed to export PDF');
+      }
+      
+      const response = await api.get(
+        `/export-jobs/${job.job_id}/download`,
         {
           responseType: 'blob'
         }
@@ -154,7 +166,7 @@ export default function CreateAssignments({ templates, quizTemplates, assignment
       showNotification('PDF downloaded successfully!', 'success');
     } catch (err) {
       console.error('Export error:', err);
-      showNotification(err.response?.data?.detail || 'Failed to export PDF', 'error');
+      showNotification(err.response?.data?.detail || err.message || 'Failed to export PDF', 'error');
     } finally {
       setBusy(false);
     }